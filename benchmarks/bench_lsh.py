@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""
+Recall and speed of approximate NGramLSH search against exact NGram search.
+
+For each band/row configuration, builds an NGramLSH over a generated corpus
+and reports, at several thresholds, the fraction of exact `search` results
+also found approximately (recall), the mean number of candidates scored per
+query, and the query throughput of both indexes.
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+"""
+
+import json, time
+
+from bench_ngram import CORPORA, SIZES, corpus, queries
+
+from ngram import NGram
+from ngram_lsh import NGramLSH
+
+CONFIGS = [(8, 2), (16, 2), (16, 4), (32, 4), (64, 4)]
+THRESHOLDS = [0.3, 0.5, 0.7]
+
+
+def measure(index, probes, threshold):
+    """Search each probe, returning results, time and candidates scored."""
+    candidates = [0]
+    def hook(stats):
+        candidates[0] += stats['candidates']
+    index.search_hook = hook
+    start = time.time()
+    results = [set(item for item, _ in index.search(query, threshold))
+               for query in probes]
+    elapsed = time.time() - start
+    index.search_hook = None
+    return results, elapsed, candidates[0] / len(probes)
+
+def recall(exact, approximate):
+    found = sum(len(e & a) for e, a in zip(exact, approximate))
+    total = sum(len(e) for e in exact)
+    return found / total if total else 1.0
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k',
+                        help='Corpus size: %(default)s')
+    parser.add_argument('--corpus', choices=sorted(CORPORA), default='names',
+                        help='Corpus kind: %(default)s')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of queries: %(default)s')
+    parser.add_argument('--config', action='append', metavar='BANDSxROWS',
+                        help='LSH configuration, may be repeated: %s' %
+                        ' '.join('%dx%d' % c for c in CONFIGS))
+    parser.add_argument('--output', metavar='PATH',
+                        help='Write JSON results to PATH')
+    args = parser.parse_args()
+    configs = ([tuple(int(x) for x in c.split('x')) for c in args.config]
+               if args.config else CONFIGS)
+    items = corpus(args.corpus, SIZES[args.size])
+    probes = queries(items, args.queries)
+    start = time.time()
+    exact_index = NGram(items)
+    print 'exact build %.2fs' % (time.time() - start)
+    exact = {}
+    for threshold in THRESHOLDS:
+        exact[threshold] = measure(exact_index, probes, threshold)
+    del exact_index
+    report = []
+    for bands, rows in configs:
+        start = time.time()
+        index = NGramLSH(items, bands=bands, rows=rows)
+        build = time.time() - start
+        for threshold in THRESHOLDS:
+            exact_results, exact_seconds, exact_candidates = exact[threshold]
+            results, seconds, candidates = measure(index, probes, threshold)
+            entry = dict(bands=bands, rows=rows, threshold=threshold,
+                         build_seconds=build,
+                         recall=recall(exact_results, results),
+                         candidates=candidates,
+                         exact_candidates=exact_candidates,
+                         queries_per_second=len(probes) / seconds,
+                         exact_queries_per_second=len(probes) / exact_seconds)
+            report.append(entry)
+            print ('%3dx%d t=%.1f recall %.3f  %8.1f candidates (exact %8.1f)'
+                   '  %8.1f q/s (exact %8.1f)  build %.2fs' % (
+                       bands, rows, threshold, entry['recall'], candidates,
+                       exact_candidates, entry['queries_per_second'],
+                       entry['exact_queries_per_second'], build))
+        del index
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
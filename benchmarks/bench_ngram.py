@@ -0,0 +1,308 @@
+#!/usr/bin/python
+"""
+Benchmarks of the core NGram index operations.
+
+Generates synthetic corpora of names, addresses and product SKUs, times
+index construction, add, remove, search at several thresholds and warps,
+compare and an end to end csvjoin, and measures the peak memory of each
+benchmark.  Every benchmark runs in a fresh child process so that peak
+memory is not inherited from earlier benchmarks.
+
+Results are written as JSON, and a previous results file can be given
+with --compare to report operations that became slower or larger.
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+"""
+
+import csv, json, os, platform, random, resource, shutil, subprocess, sys
+import tempfile, time
+from multiprocessing import Process, Queue
+from Queue import Empty
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'scripts')]
+
+from ngram import NGram
+
+SIZES = {'10k': 10000, '100k': 100000, '1M': 1000000, '10M': 10000000}
+
+SYLLABLES = ['an', 'ber', 'cha', 'del', 'el', 'fra', 'gor', 'han', 'is', 'jo',
+             'ka', 'li', 'mar', 'nos', 'ol', 'pe', 'qui', 'ro', 'sa', 'tin',
+             'u', 'ver', 'wil', 'xa', 'yo', 'zen']
+STREETS = ['Main', 'Church', 'High', 'Station', 'Park', 'Victoria', 'Mill',
+           'Green', 'Oak', 'Kings', 'Queens', 'School', 'North', 'West']
+SUFFIXES = ['Street', 'Road', 'Avenue', 'Lane', 'Drive', 'Close', 'Way']
+
+
+def name(rnd):
+    word = lambda: ''.join(rnd.choice(SYLLABLES)
+                           for _ in range(rnd.randint(1, 3))).capitalize()
+    return '%s %s' % (word(), word())
+
+def address(rnd):
+    return '%d %s %s, %s' % (rnd.randint(1, 999), rnd.choice(STREETS),
+                             rnd.choice(SUFFIXES), name(rnd).split()[1])
+
+def sku(rnd):
+    letters = 'ABCDEFGHJKLMNPQRSTUVWXYZ'
+    return '%s-%04d-%s' % (''.join(rnd.choice(letters) for _ in range(3)),
+                           rnd.randint(0, 9999),
+                           ''.join(rnd.choice(letters) for _ in range(2)))
+
+CORPORA = {'names': name, 'addresses': address, 'skus': sku}
+
+
+def corpus(kind, size, seed=0):
+    """Generate `size` distinct strings of the given kind."""
+    rnd = random.Random(seed)
+    generate = CORPORA[kind]
+    items = set()
+    while len(items) < size:
+        items.add(generate(rnd))
+    return sorted(items)
+
+def perturb(item, rnd):
+    """Apply a random single-character edit, simulating a dirty query."""
+    i = rnd.randrange(len(item))
+    edit = rnd.choice('dis')
+    char = rnd.choice('abcdefghijklmnopqrstuvwxyz')
+    if edit == 'd':
+        return item[:i] + item[i+1:]
+    elif edit == 'i':
+        return item[:i] + char + item[i:]
+    return item[:i] + char + item[i+1:]
+
+def queries(items, count, seed=1):
+    rnd = random.Random(seed)
+    return [perturb(rnd.choice(items), rnd) for _ in range(count)]
+
+
+def timed(func, repeat, reset=None):
+    """Return the best wall time of `repeat` calls of func, calling the
+    untimed `reset` after each call if given."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if reset is not None:
+            reset()
+    return best
+
+def bench_construct(**kwargs):
+    def bench(items, options):
+        return timed(lambda: NGram(items, **kwargs), 1), len(items)
+    return bench
+
+def bench_add(items, options):
+    index = NGram(items[options.ops:])
+    extra = items[:options.ops]
+    def run():
+        for item in extra:
+            index.add(item)
+    return timed(run, options.repeat,
+                 lambda: index.difference_update(extra)), len(extra)
+
+def bench_remove(items, options):
+    index = NGram(items)
+    victims = items[:options.ops]
+    def run():
+        for item in victims:
+            index.remove(item)
+    return timed(run, options.repeat,
+                 lambda: index.update(victims)), len(victims)
+
+def bench_search(threshold, warp, **kwargs):
+    def bench(items, options):
+        index = NGram(items, warp=warp, **kwargs)
+        probes = queries(items, options.queries)
+        def run():
+            for query in probes:
+                index.search(query, threshold)
+        return timed(run, options.repeat), len(probes)
+    return bench
+
+def bench_compare(items, options):
+    rnd = random.Random(2)
+    pairs = [(item, perturb(item, rnd)) for item in items[:options.ops]]
+    def run():
+        for s1, s2 in pairs:
+            NGram.compare(s1, s2)
+    return timed(run, options.repeat), len(pairs)
+
+def bench_sqlite_construct(items, options):
+    from ngram_sqlite import NGramSQLite
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'index.db')
+        return timed(lambda: NGramSQLite(items, path=path).close(), 1), len(items)
+    finally:
+        shutil.rmtree(workdir)
+
+def bench_sqlite_search(threshold, warp):
+    def bench(items, options):
+        from ngram_sqlite import NGramSQLite
+        workdir = tempfile.mkdtemp()
+        try:
+            index = NGramSQLite(items, warp=warp,
+                                path=os.path.join(workdir, 'index.db'))
+            probes = queries(items, options.queries)
+            def run():
+                for query in probes:
+                    index.search(query, threshold)
+            return timed(run, options.repeat), len(probes)
+        finally:
+            shutil.rmtree(workdir)
+    return bench
+
+def bench_csvjoin(items, options):
+    import csvjoin
+    workdir = tempfile.mkdtemp()
+    try:
+        left = os.path.join(workdir, 'left.csv')
+        right = os.path.join(workdir, 'right.csv')
+        csv.writer(open(right, 'w')).writerows(enumerate(items))
+        probes = queries(items, options.queries)
+        csv.writer(open(left, 'w')).writerows(enumerate(probes))
+        elapsed = timed(lambda: csvjoin.main(
+            left, 1, right, 1, os.path.join(workdir, 'out.csv'), False,
+            'outer', 0.24, 5, 1.0, jobs=options.jobs), 1)
+        return elapsed, len(probes)
+    finally:
+        shutil.rmtree(workdir)
+
+BENCHMARKS = [
+    ('construct', bench_construct()),
+    ('construct_packed', bench_construct(gram_ids='packed')),
+    ('construct_hashed', bench_construct(gram_ids='hashed')),
+    ('add', bench_add),
+    ('remove', bench_remove),
+    ('search_t0.0_w1', bench_search(0.0, 1.0)),
+    ('search_t0.3_w1', bench_search(0.3, 1.0)),
+    ('search_t0.6_w1', bench_search(0.6, 1.0)),
+    ('search_t0.3_w2', bench_search(0.3, 2.0)),
+    ('search_t0.3_w1_packed', bench_search(0.3, 1.0, gram_ids='packed')),
+    ('compare', bench_compare),
+    ('csvjoin', bench_csvjoin),
+    ('sqlite_construct', bench_sqlite_construct),
+    ('sqlite_search_t0.3_w1', bench_sqlite_search(0.3, 1.0)),
+]
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _child(queue, kind, size, func, options):
+    items = corpus(kind, size)
+    base = peak_rss_kb()
+    seconds, operations = func(items, options)
+    queue.put(dict(seconds=seconds, operations=operations,
+                   ops_per_second=operations / seconds if seconds else None,
+                   peak_rss_kb=peak_rss_kb(),
+                   peak_rss_over_corpus_kb=peak_rss_kb() - base))
+
+def run_isolated(kind, size, func, options):
+    """Run one benchmark in a child process and return its measurements."""
+    queue = Queue()
+    child = Process(target=_child, args=(queue, kind, size, func, options))
+    child.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            if not child.is_alive():
+                raise RuntimeError('benchmark process failed')
+    child.join()
+    return result
+
+def environment():
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return dict(revision=revision, python=platform.python_version(),
+                machine=platform.machine(), processor=platform.processor(),
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+def compare_results(baseline, current, tolerance):
+    """Return descriptions of benchmarks that regressed beyond tolerance."""
+    regressions = []
+    for name, result in sorted(current.iteritems()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for field in ('seconds', 'peak_rss_kb'):
+            if old[field] and result[field] > old[field] * (1 + tolerance):
+                regressions.append('%s: %s %.4g -> %.4g (+%.0f%%)' % (
+                    name, field, old[field], result[field],
+                    100 * (result[field] / old[field] - 1)))
+    return regressions
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--size', action='append', choices=sorted(SIZES),
+                        help='Corpus size, may be repeated: 10k')
+    parser.add_argument('--corpus', action='append', choices=sorted(CORPORA),
+                        help='Corpus kind, may be repeated: all kinds')
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        help='Run only benchmarks whose name starts with NAME')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of search queries: %(default)s')
+    parser.add_argument('--ops', type=int, default=1000,
+                        help='Number of add/remove/compare operations: %(default)s')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Repeats of fast benchmarks, best is kept: %(default)s')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for the csvjoin benchmark: %(default)s')
+    parser.add_argument('--output', metavar='PATH',
+                        help='Write JSON results to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Report regressions against earlier JSON results')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional slowdown or growth: %(default)s')
+    options = parser.parse_args()
+    results = {}
+    for size in options.size or ['10k']:
+        for kind in options.corpus or sorted(CORPORA):
+            for bench, func in BENCHMARKS:
+                if options.only and not any(bench.startswith(prefix)
+                                            for prefix in options.only):
+                    continue
+                name = '%s/%s/%s' % (kind, size, bench)
+                result = run_isolated(kind, SIZES[size], func, options)
+                results[name] = result
+                print '%-32s %9.4fs %12.1f ops/s %9d KiB' % (
+                    name, result['seconds'], result['ops_per_second'] or 0,
+                    result['peak_rss_kb'])
+                sys.stdout.flush()
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(dict(environment=environment(), results=results), f,
+                      indent=2, sort_keys=True)
+    if options.compare:
+        baseline = json.load(open(options.compare))['results']
+        regressions = compare_results(baseline, results, options.tolerance)
+        for regression in regressions:
+            print 'REGRESSION', regression
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""
+Memory and search speed of the posting list layouts.
+
+Builds an NGram over a generated corpus, freezes it into a FrozenNGram and
+a CompressedNGram, and reports for each layout the bytes taken by the
+posting lists and the query throughput.  The posting lists of NGram are
+counted as the size of its posting dictionaries, without the items and
+integers they refer to, which all layouts share or intern.
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+"""
+
+import json, sys, time
+
+from bench_ngram import CORPORA, SIZES, corpus, queries
+
+from ngram import NGram
+
+
+def array_bytes(*arrays):
+    return sum(a.itemsize * len(a) for a in arrays)
+
+def posting_bytes(index):
+    """Bytes of the posting lists of an index of any layout."""
+    if isinstance(index, NGram):
+        return sum(sys.getsizeof(p) for p in index._grams.itervalues())
+    return array_bytes(*[getattr(index, '_' + name) for name in index._ARRAYS
+                         if name != 'lengths'])
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--size', choices=sorted(SIZES), default='100k',
+                        help='Corpus size: %(default)s')
+    parser.add_argument('--corpus', choices=sorted(CORPORA), default='names',
+                        help='Corpus kind: %(default)s')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of queries: %(default)s')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='Search threshold: %(default)s')
+    parser.add_argument('--gram-ids', choices=['packed', 'hashed'],
+                        help='Build the NGram with integer n-gram ids')
+    parser.add_argument('--output', metavar='PATH',
+                        help='Write JSON results to PATH')
+    args = parser.parse_args()
+    items = corpus(args.corpus, SIZES[args.size])
+    probes = queries(items, args.queries)
+    index = NGram(items, gram_ids=args.gram_ids)
+    layouts = [('dict', index), ('frozen', index.freeze()),
+               ('compressed', index.freeze(compress=True))]
+    report = []
+    for layout, layout_index in layouts:
+        start = time.time()
+        for query in probes:
+            layout_index.search(query, args.threshold)
+        seconds = time.time() - start
+        entry = dict(layout=layout, posting_bytes=posting_bytes(layout_index),
+                     queries_per_second=len(probes) / seconds)
+        report.append(entry)
+        print '%-10s %12d posting bytes %6.1fx smaller %9.1f q/s' % (
+            layout, entry['posting_bytes'],
+            report[0]['posting_bytes'] / entry['posting_bytes'],
+            entry['queries_per_second'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+"""
+Replay a query log against an N-gram index and report latency.
+
+Builds an NGram from a corpus file (one item per line), or connects to an
+existing NGramRedis database, then runs every query of the log (one query
+per line) through `search` or `find`, optionally from several threads at
+once.  Reports throughput, p50/p95/p99 latency with a histogram, the
+distribution of candidate counts from `items_sharing_ngrams`, and the
+slowest queries with their candidate counts.
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+"""
+
+import json, math, os, sys, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list.
+
+    >>> percentile([1, 2, 3, 4], 0.5)
+    2
+    >>> percentile([1, 2, 3, 4], 0.99)
+    4
+    """
+    if not ordered:
+        return None
+    rank = max(0, int(math.ceil(fraction * len(ordered))) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def histogram(values, buckets):
+    """Count values falling below each bucket boundary, with a final bucket
+    for larger values.
+
+    >>> histogram([0.5, 1.5, 7], [1, 2, 5])
+    [(1, 1), (2, 1), (5, 0), (None, 1)]
+    """
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        for i, bound in enumerate(buckets):
+            if value < bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return zip(list(buckets) + [None], counts)
+
+# Latency histogram boundaries in milliseconds
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+CANDIDATE_BUCKETS = [1, 10, 100, 1000, 10000, 100000, 1000000]
+
+
+def replay(index, queries, operation='search', threshold=None, threads=1):
+    """Run the queries against the index.
+
+    :return: list of ``(query, seconds, candidates, results)`` in query order\
+    and the wall time of the whole replay.
+    """
+    records = [None] * len(queries)
+    position = [0]
+    lock = threading.Lock()
+    # The hook runs in the thread doing the search
+    local = threading.local()
+    def hook(stats):
+        local.candidates = stats['candidates']
+    index.search_hook = hook
+    def worker():
+        while True:
+            with lock:
+                i = position[0]
+                position[0] += 1
+            if i >= len(queries):
+                return
+            query = queries[i]
+            start = time.time()
+            if operation == 'find':
+                result = index.find(query, threshold)
+                results = 0 if result is None else 1
+            else:
+                results = len(index.search(query, threshold))
+            elapsed = time.time() - start
+            records[i] = (query, elapsed, local.candidates, results)
+    start = time.time()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        index.search_hook = None
+    return records, time.time() - start
+
+def summarize(records, elapsed, slowest=10):
+    """Return a report of latency, throughput and candidate counts."""
+    latencies = sorted(r[1] * 1000 for r in records)
+    candidates = sorted(r[2] for r in records)
+    mean = lambda values: sum(values) / len(values) if values else None
+    return dict(
+        queries=len(records),
+        elapsed_seconds=elapsed,
+        queries_per_second=len(records) / elapsed if elapsed else None,
+        latency_ms=dict(
+            mean=mean(latencies), p50=percentile(latencies, 0.5),
+            p95=percentile(latencies, 0.95), p99=percentile(latencies, 0.99),
+            max=latencies[-1] if latencies else None,
+            histogram=histogram(latencies, LATENCY_BUCKETS)),
+        candidates=dict(
+            mean=mean(candidates), p50=percentile(candidates, 0.5),
+            p95=percentile(candidates, 0.95), p99=percentile(candidates, 0.99),
+            max=candidates[-1] if candidates else None,
+            histogram=histogram(candidates, CANDIDATE_BUCKETS)),
+        slowest=[dict(query=query, latency_ms=seconds * 1000,
+                      candidates=count, results=results)
+                 for query, seconds, count, results in
+                 sorted(records, key=lambda r: r[1], reverse=True)[:slowest]])
+
+def print_report(report, stream=sys.stdout):
+    write = lambda line='': stream.write(line + '\n')
+    write('%d queries in %.2fs: %.1f queries/s' % (
+        report['queries'], report['elapsed_seconds'],
+        report['queries_per_second'] or 0))
+    for title, key, unit in [('Latency', 'latency_ms', 'ms'),
+                             ('Candidates', 'candidates', '')]:
+        stats = report[key]
+        write()
+        write('%s (%s): mean %.3f p50 %.3f p95 %.3f p99 %.3f max %.3f' % (
+            title, unit or 'count', stats['mean'] or 0, stats['p50'] or 0,
+            stats['p95'] or 0, stats['p99'] or 0, stats['max'] or 0))
+        for bound, count in stats['histogram']:
+            label = '< %s%s' % (bound, unit) if bound is not None else '>='
+            write('  %12s %8d %s' % (label, count, '#' * int(
+                60 * count / max(report['queries'], 1))))
+    write()
+    write('Slowest queries:')
+    for entry in report['slowest']:
+        write('  %10.3fms %9d candidates %5d results  %r' % (
+            entry['latency_ms'], entry['candidates'], entry['results'],
+            entry['query']))
+
+def read_lines(path):
+    with open(path) as f:
+        return [line.rstrip('\r\n') for line in f if line.strip()]
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--corpus', metavar='PATH',
+                        help='Build an NGram from items in PATH, one per line')
+    source.add_argument('--redis-db', type=int, metavar='DB',
+                        help='Query an existing NGramRedis database')
+    parser.add_argument('--operation', choices=['search', 'find'],
+                        default='search', help='Index method: %(default)s')
+    parser.add_argument('--threshold', type=float,
+                        help='Search threshold, default is the index threshold')
+    parser.add_argument('--warp', type=float, default=1.0,
+                        help='N-gram warp: %(default)s')
+    parser.add_argument('-N', type=int, default=3,
+                        help='Characters per n-gram: %(default)s')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Concurrent querying threads: %(default)s')
+    parser.add_argument('--slowest', type=int, default=10,
+                        help='Number of slowest queries to list: %(default)s')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the report as JSON to PATH')
+    parser.add_argument('querylog', help='File of queries, one per line')
+    args = parser.parse_args()
+    queries = read_lines(args.querylog)
+    start = time.time()
+    if args.corpus:
+        from ngram import NGram
+        index = NGram(read_lines(args.corpus), warp=args.warp, N=args.N)
+    else:
+        from ngram_redis import NGramRedis
+        index = NGramRedis(warp=args.warp, N=args.N, db=args.redis_db)
+    sys.stderr.write('Index ready in %.2fs\n' % (time.time() - start))
+    records, elapsed = replay(index, queries, args.operation, args.threshold,
+                              args.threads)
+    report = summarize(records, elapsed, args.slowest)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,7 +22,25 @@ Lesser General Public License for more details.
 See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
 """
 
-from ngram_abstract import NGramAbstract
+import cPickle as pickle
+import heapq
+import sys
+import time
+
+from itertools import islice
+
+from ngram_abstract import NGramAbstract, SearchResults, _summary
+from ngram_vector import batch_gram_ids
+
+# Number of items whose n-gram ids `update` computes at once
+_BATCH_SIZE = 10000
+
+# Candidates whose counts are completed between checks of a search deadline
+_DEADLINE_CHECK = 256
+
+# Remove items from an index by one pass over the posting lists once they are
+# at least 1/_SCAN_FRACTION of its items, rather than by splitting each item
+_SCAN_FRACTION = 4
 
 class NGram(set, NGramAbstract):
     """A set that supports lookup by NGram string similarity.
@@ -61,19 +79,57 @@ class NGram(set, NGramAbstract):
 
     :param key: Function to convert items into string, default is no conversion.
 
+    :type gram_ids: None, 'packed' or 'hashed'
+
+    :param gram_ids: how n-grams are keyed in the index.  None keys them by\
+    the n-gram strings.  'packed' keys them by an integer packing the code\
+    points of the n-gram into ``64 // N`` bits each, which is exact and\
+    requires ``N <= 8`` and every code point below ``2 ** (64 // N)`` (all of\
+    unicode for N=3, the BMP for N=4, bytes for N=8).  'hashed' keys them by\
+    a 61-bit Rabin-Karp rolling hash, for any N and alphabet.  Two distinct\
+    n-grams collide with probability about 2**-61, and a collision makes the\
+    index count them as the same n-gram, overstating the similarity of the\
+    items containing them.  Integer keys avoid storing n-gram strings and\
+    creating slices of the query.
+
+    :type max_df: None, float in 0.0 ... 1.0 or int >= 1
+
+    :param max_df: document frequency cap, as a fraction of the items or a\
+    number of items.  N-grams of the query contained in more items than this,\
+    such as ``'$$s'``, are stop-grams that are skipped when looking for\
+    candidates, as they make many candidates that rarely rank.  They are still\
+    counted when scoring the candidates found through other n-grams, so\
+    similarities stay exact, but items sharing only stop-grams with the query\
+    are not found.  None to skip no n-grams.
+
     Instance variables:
 
     :ivar _grams: For each n-gram, the items containing it and the number of times\
-    the n-gram occurs in the item as ``{str:{item:int, ...}, ...}``.
+    the n-gram occurs in the item as ``{str:{item:int, ...}, ...}``, keyed by\
+    integers instead of strings with `gram_ids`.
 
     :ivar length: maps items to length of the padded string representations as
     ``{item:int, ...}``.
     """
 
     def __init__(self, items=[], threshold=0.0, warp=1.0, key=None,
-                    N=3, pad_len=None, pad_char='$'):
+                    N=3, pad_len=None, pad_char='$', gram_ids=None,
+                    max_df=None):
         set.__init__(self)
         self.length = {}
+        if gram_ids not in (None, 'packed', 'hashed'):
+            raise ValueError("gram_ids not None, 'packed' or 'hashed': " +
+                             str(gram_ids))
+        if gram_ids == 'packed' and not 1 <= N <= 8:
+            raise ValueError("Packed gram_ids require 1 <= N <= 8, not: " +
+                             str(N))
+        if max_df is not None and not (
+                max_df >= 1 if isinstance(max_df, (int, long))
+                else 0.0 <= max_df <= 1.0):
+            raise ValueError("Require max_df in 0.0 ... 1.0 or int >= 1, not: "
+                             + str(max_df))
+        self.gram_ids = gram_ids
+        self.max_df = max_df
         NGramAbstract.__init__(self, items, threshold , warp, key, N, pad_len,
                 pad_char)
 
@@ -90,7 +146,38 @@ class NGram(set, NGramAbstract):
         NGram([3735928559, 48879])
         """
         return NGram, (list(self), self.threshold, self.warp, self._key,
-                       self.N, self._pad_len, self._pad_char)
+                       self.N, self._pad_len, self._pad_char, self.gram_ids,
+                       self.max_df)
+
+    def dump(self, f, protocol=pickle.HIGHEST_PROTOCOL):
+        """Write the built index to an open binary file.  Unlike pickling the
+        NGram, this stores the n-gram index itself so that `load` does not need
+        to re-index the items.  The key function must be picklable.
+
+        >>> from StringIO import StringIO
+        >>> f = StringIO()
+        >>> NGram(['eggs', 'spam'], N=2).dump(f)
+        >>> f.seek(0)
+        >>> m = NGram.load(f)
+        >>> m, m.N
+        (NGram(['eggs', 'spam']), 2)
+        >>> m.search('spa')
+        [('spam', 0.5)]
+        """
+        params = dict(threshold=self.threshold, warp=self.warp, key=self._key,
+                      N=self.N, pad_len=self._pad_len, pad_char=self._pad_char,
+                      gram_ids=self.gram_ids, max_df=self.max_df)
+        pickle.dump((params, self.length, self._grams), f, protocol)
+
+    @classmethod
+    def load(cls, f):
+        """Read an index written by `dump` from an open binary file."""
+        params, length, grams = pickle.load(f)
+        index = cls(**params)
+        set.update(index, length)
+        index.length = length
+        index._grams = grams
+        return index
 
     def copy(self):
         """Return a shallow copy of the NGram object.  That is, instantiate
@@ -106,7 +193,27 @@ class NGram(set, NGramAbstract):
         NGram(['eggs', 'ham', 'spam'])
         """
         return NGram(self, self.threshold, self.warp, self._key,
-                     self.N, self._pad_len, self._pad_char)
+                     self.N, self._pad_len, self._pad_char, self.gram_ids,
+                     self.max_df)
+
+    def freeze(self, compress=False):
+        """Compile the index into a read-only `FrozenNGram`, which searches
+        with the same results from compact arrays instead of dictionaries.
+        Later changes to this NGram do not affect the frozen index.
+
+        :param compress: return a `CompressedNGram`, whose posting lists\
+        take several times less memory but are slower to search.
+
+        >>> n = NGram(['eggs', 'spam']).freeze()
+        >>> n.search('spa')
+        [('spam', 0.375)]
+        >>> n.add('ham')
+        Traceback (most recent call last):
+        ...
+        TypeError: FrozenNGram is read-only
+        """
+        from ngram_frozen import CompressedNGram, FrozenNGram
+        return (CompressedNGram if compress else FrozenNGram).from_ngram(self)
 
     def add(self, item):
         """Add an item to the N-gram index (only if it has not already been added).
@@ -120,16 +227,21 @@ class NGram(set, NGramAbstract):
         NGram(['ham', 'spam'])
         """
         if item not in self:
-            # Add the item to the base set
-            super(NGram, self).add(item)
-            # Record length of padded string
             padded_item = self.pad(self.key(item))
-            self.length[item] = len(padded_item)
-            for ngram in self._split(padded_item):
-                # Add a new n-gram and string to index if necessary
-                self._grams.setdefault(ngram, {}).setdefault(item, 0)
-                # Increment number of times the n-gram appears in the string
-                self._grams[ngram][item] += 1
+            self._add_grams(item, len(padded_item),
+                            self._gram_ids(padded_item))
+
+    def _add_grams(self, item, length, ngrams):
+        """Index a new item given its padded length and n-gram keys."""
+        # Add the item to the base set
+        super(NGram, self).add(item)
+        # Record length of padded string
+        self.length[item] = length
+        for ngram in ngrams:
+            # Add a new n-gram and string to index if necessary
+            self._grams.setdefault(ngram, {}).setdefault(item, 0)
+            # Increment number of times the n-gram appears in the string
+            self._grams[ngram][item] += 1
 
     def remove(self, item):
         """Remove an item from the index. Inverts the add operation.
@@ -138,44 +250,267 @@ class NGram(set, NGramAbstract):
         >>> n.remove('spam')
         >>> n
         NGram(['eggs'])
+        >>> n.update(['hamham'])
+        >>> n.remove('hamham')
+        >>> n
+        NGram(['eggs'])
         """
         if item in self:
             super(NGram, self).remove(item)
             del self.length[item]
-            for ngram in self.splititem(item):
+            # An n-gram repeated within the item has a single entry
+            for ngram in set(self._gram_ids(self.pad(self.key(item)))):
                 del self._grams[ngram][item]
 
-    def items_sharing_ngrams(self, query):
+    def items_sharing_ngrams(self, query, stats=None):
         """Retrieve the subset of items that share n-grams the query string.
 
         :param query: look up items that share N-grams with this string.
+        :param stats: optional dictionary in which to count the ``grams`` and\
+        ``postings_scanned``, see `search_hook`.
         :return: dictionary from matched string to the number of shared N-grams.
 
         >>> n = NGram(["ham","spam","eggs"])
         >>> n.items_sharing_ngrams("mam")
         {'ham': 2, 'spam': 2}
         """
+        return self._shared(self._gram_ids(self.pad(query), True), stats)[0]
+
+    def _df_cap(self):
+        """Number of items above which an n-gram is a stop-gram, or None."""
+        if self.max_df is None or isinstance(self.max_df, (int, long)):
+            return self.max_df
+        return self.max_df * len(self)
+
+    def stop_grams(self):
+        """Return the n-grams currently skipped as stop-grams under `max_df`.
+
+        >>> n = NGram(["spam", "spat", "spin", "ham"], max_df=0.5)
+        >>> sorted(n.stop_grams())
+        ['$$s', '$sp']
+        """
+        cap = self._df_cap()
+        if cap is None:
+            return []
+        return [ngram for ngram, posting in self._grams.iteritems()
+                if len(posting) > cap]
+
+    def stats(self, top=10):
+        """Describe the size and shape of the index, for capacity planning
+        and for choosing `max_df`.
+
+        :param top: number of heaviest n-grams to list.
+
+        :return: dictionary of the number of ``items``, distinct ``grams``\
+        with a posting list, ``empty_grams`` whose posting lists were emptied\
+        by removals, total ``postings`` entries, the ``posting_lengths``\
+        summary (``min``, ``median``, ``p99``, ``max`` and ``mean``), the\
+        ``top_grams`` as (n-gram, posting list length) pairs, the number of\
+        ``stop_grams`` under `max_df`, the ``mean_padded_length`` of the\
+        items, and a ``memory`` estimate in bytes of the ``gram_table``\
+        (``_grams`` and its keys), the ``postings`` dictionaries, the\
+        ``length`` dictionary, the ``item_set`` table and the ``items``\
+        themselves (shallow sizes), with their ``total``.
+
+        >>> n = NGram(["spam", "spat", "ham"])
+        >>> info = n.stats(top=2)
+        >>> info['items'], info['grams'], info['postings'], info['top_grams']
+        (3, 12, 17, [('$$s', 2), ('$sp', 2)])
+        >>> sorted(info['posting_lengths'].items())
+        [('max', 2), ('mean', 1.4166666666666667), ('median', 1), ('min', 1), ('p99', 2)]
+        >>> sorted(info['memory'])
+        ['gram_table', 'item_set', 'items', 'length', 'postings', 'total']
+        """
+        sizes = [len(posting) for posting in self._grams.itervalues()]
+        heaviest = heapq.nsmallest(top, ((ngram, len(posting)) for ngram, posting
+                                         in self._grams.iteritems() if posting),
+                                   key=lambda entry: (-entry[1], entry[0]))
+        memory = dict(
+            gram_table=sys.getsizeof(self._grams) +
+                sum(sys.getsizeof(ngram) for ngram in self._grams),
+            postings=sum(sys.getsizeof(posting)
+                         for posting in self._grams.itervalues()),
+            length=sys.getsizeof(self.length),
+            item_set=set.__sizeof__(self),
+            items=sum(sys.getsizeof(item) for item in self))
+        memory['total'] = sum(memory.values())
+        return dict(items=len(self), grams=sum(1 for size in sizes if size),
+                    empty_grams=sizes.count(0), postings=sum(sizes),
+                    posting_lengths=_summary(size for size in sizes if size),
+                    top_grams=heaviest,
+                    stop_grams=len(self.stop_grams()),
+                    mean_padded_length=_summary(
+                        self.length.itervalues())['mean'],
+                    memory=memory)
+
+    def _shared(self, ngrams, stats=None, deadline=None, max_postings=None):
+        """Count the n-grams shared with each item, given the query n-grams.
+
+        With a budget, the posting lists are scanned rarest first until the
+        next one would pass `max_postings` entries in total, or half the time
+        to `deadline` has passed.  The counts of the items found are then
+        completed from the posting lists not scanned, as they are for
+        stop-grams, so that their similarities are exact.  Past the deadline,
+        the items with the fewest n-grams found so far are dropped instead of
+        completed.
+
+        :param deadline: `time.time` after which to stop scanning.
+
+        :param max_postings: maximum posting list entries to scan.
+
+        :return: dictionary from item to number of shared n-grams, and\
+        whether every posting list was scanned.
+
+        >>> n = NGram(["spam", "spat", "spin", "ham"], max_df=0.5)
+        >>> import sys
+        >>> n.search_hook = lambda stats: sys.stdout.write(
+        ...     "%(pruned)d pruned\\n" % stats)
+        >>> n.search("spam")
+        2 pruned
+        [('spam', 1.0), ('spat', 0.3333333333333333), ('ham', 0.2222222222222222)]
+        """
+        grams = self._grams
+        cap = self._df_cap()
+        wanted = {}
+        for ngram in ngrams:
+            if stats is not None:
+                stats['grams'] += 1
+            wanted[ngram] = wanted.get(ngram, 0) + 1
+        # (occurrences in the query, posting list) to scan or to skip
+        scan = []
+        skipped = []
+        for ngram, occurrences in wanted.iteritems():
+            posting = grams.get(ngram)
+            if not posting:
+                continue
+            if cap is not None and len(posting) > cap:
+                skipped.append((occurrences, posting))
+                if stats is not None:
+                    stats['pruned'] += occurrences
+            else:
+                scan.append((occurrences, posting))
+        bounded = deadline is not None or max_postings is not None
+        if bounded:
+            scan.sort(key=lambda entry: len(entry[1]))
+        if deadline is not None:
+            # Leave half the time for completing the counts
+            scan_deadline = (time.time() + deadline) / 2
         # From matched string to number of N-grams shared with query string
         shared = {}
-        # Dictionary mapping n-gram to string to number of occurrences of that
-        # ngram in the string that remain to be matched.
-        remaining = {}
-        for ngram in self.split(query):
-            try:
-                for match, count in self._grams[ngram].iteritems():
-                    remaining.setdefault(ngram, {}).setdefault(match, count)
-                    # match up to as many occurrences of ngram as exist in the matched string
-                    if remaining[ngram][match] > 0:
-                        remaining[ngram][match] -= 1
-                        shared.setdefault(match, 0)
-                        shared[match] += 1
-            except KeyError:
-                pass
-        return shared
+        scanned = 0
+        complete = True
+        for i, (occurrences, posting) in enumerate(scan):
+            if bounded and (
+                    (max_postings is not None and
+                     scanned + len(posting) > max_postings) or
+                    (deadline is not None and time.time() > scan_deadline)):
+                skipped.extend(scan[i:])
+                complete = False
+                break
+            scanned += len(posting)
+            if occurrences == 1:
+                for match in posting:
+                    shared[match] = shared.get(match, 0) + 1
+                continue
+            for match, count in posting.iteritems():
+                # match up to as many occurrences as exist in both strings
+                shared[match] = shared.get(match, 0) + min(occurrences, count)
+        if stats is not None:
+            stats['postings_scanned'] += scanned
+        if not skipped:
+            return shared, complete
+        # Complete the counts of the candidates with the n-grams skipped,
+        # best candidates first, dropping those left when the time is up
+        candidates = shared.keys()
+        if deadline is not None:
+            candidates.sort(key=shared.get, reverse=True)
+        for i, match in enumerate(candidates):
+            if (deadline is not None and i and not i % _DEADLINE_CHECK and
+                    time.time() > deadline):
+                for match in candidates[i:]:
+                    del shared[match]
+                complete = False
+                break
+            for occurrences, posting in skipped:
+                count = posting.get(match)
+                if count:
+                    shared[match] += min(occurrences, count)
+        return shared, complete
 
     def get_item_length(self, match):
         return self.length[match]
 
+    def search(self, query, threshold=None, timeout=None, max_postings=None):
+        """Search the index for items whose key exceeds threshold
+        similarity to the query string, within an optional budget.
+
+        :param timeout: seconds after which to stop looking for candidates.
+
+        :param max_postings: maximum number of posting list entries to scan\
+        when looking for candidates.
+
+        :return: `SearchResults` of pairs of (item, similarity) by decreasing\
+        similarity.  When a budget runs out, posting lists are left unscanned\
+        and ``complete`` is False, but the items returned still have their\
+        exact similarity.  Scanning the rarest n-grams first keeps the items\
+        most similar to the query the likeliest to be found.
+
+        >>> n = NGram(["spam", "spat", "spin", "ham"])
+        >>> results = n.search("spam", max_postings=1)
+        >>> results, results.complete
+        ([('spam', 1.0)], False)
+        >>> n.search("spam", max_postings=100).complete
+        True
+        """
+        if timeout is None and max_postings is None:
+            return SearchResults(super(NGram, self).search(query, threshold))
+        hook = self.search_hook
+        stats = self._new_stats(query) if hook is not None else None
+        start = time.time()
+        deadline = start + timeout if timeout is not None else None
+        ngrams = self._gram_ids(self.pad(query), True)
+        shared, complete = self._shared(ngrams, stats, deadline, max_postings)
+        middle = time.time()
+        results = SearchResults(self.rank_candidates(query, shared, threshold),
+                                complete)
+        if hook is not None:
+            end = time.time()
+            stats.update(candidates=len(shared), scored=len(shared),
+                         matched=len(results), candidate_seconds=middle - start,
+                         score_seconds=end - middle, total_seconds=end - start)
+            hook(stats)
+        return results
+
+    def find(self, query, threshold=None, timeout=None, max_postings=None):
+        """Simply return the best match to the query, None on no match,
+        within an optional budget as for `search`.
+
+        >>> NGram(["Spam", "Eggs", "Ham"]).find("Spom", max_postings=2)
+        'Spam'
+        """
+        results = self.search(query, threshold, timeout, max_postings)
+        if results:
+            return results[0][0]
+        else:
+            return None
+
+    def search_batch(self, queries, threshold=None):
+        """Search the index for each of several query strings.
+
+        With `gram_ids`, the n-gram ids of all the queries are computed at
+        once by `ngram_vector.batch_gram_ids`.
+
+        >>> n = NGram(["ham", "spam", "eggs"], gram_ids='packed')
+        >>> n.search_batch(["ham", "egg"], threshold=0.3)
+        [[('ham', 1.0)], [('eggs', 0.375)]]
+        """
+        if self.gram_ids is None or self.search_hook is not None:
+            return super(NGram, self).search_batch(queries, threshold)
+        padded = [self.pad(query) for query in queries]
+        return [self.rank_candidates(query, self._shared(ngrams)[0], threshold)
+                for query, ngrams in zip(queries, batch_gram_ids(self, padded,
+                                                                 query=True))]
+
     @staticmethod
     def compare(s1, s2, **kwargs):
         """Compares two strings and returns their similarity.
@@ -204,20 +539,80 @@ class NGram(set, NGramAbstract):
         except IndexError:
             return 0.0
 
-    def difference_update(self, other):
-        """Remove from this set all elements from `other` set.
+    def _compatible(self, other):
+        """Whether `other` is an index of the same type with the same key
+        function, N, padding and `gram_ids`, so that its posting lists can be
+        merged into or subtracted from this one."""
+        return (type(other) is type(self) and other._key == self._key and
+                other.N == self.N and other._pad_len == self._pad_len and
+                other._pad_char == self._pad_char and
+                other.gram_ids == self.gram_ids)
+
+    def _merge(self, other, items):
+        """Add items of a compatible index that are not in this one, copying
+        their posting list entries and lengths instead of splitting them."""
+        if not items:
+            return
+        super(NGram, self).update(items)
+        for item in items:
+            self.length[item] = other.length[item]
+        grams = self._grams
+        whole = len(items) == len(other)
+        for ngram, posting in other._grams.iteritems():
+            if whole:
+                if posting:
+                    grams.setdefault(ngram, {}).update(posting)
+                continue
+            for item, count in posting.iteritems():
+                if item in items:
+                    grams.setdefault(ngram, {})[item] = count
+
+    def _remove_items(self, items, source):
+        """Remove items that are in the index.  When they are a large enough
+        part of `source`, a compatible index containing them, their entries
+        are found by one pass over the posting lists of `source` instead of
+        by splitting each of them."""
+        if not (self._compatible(source) and
+                len(items) * _SCAN_FRACTION >= len(source)):
+            for item in items:
+                self.remove(item)
+            return
+        items = set(items)
+        super(NGram, self).difference_update(items)
+        for item in items:
+            del self.length[item]
+        grams = self._grams
+        # items() makes a list, as the posting lists of source may be ours
+        for ngram, posting in source._grams.items():
+            target = grams.get(ngram)
+            if not target:
+                continue
+            for item in posting.keys():
+                if item in items:
+                    target.pop(item, None)
+            if not target:
+                del grams[ngram]
+
+    def difference_update(self, *others):
+        """Remove from this set all elements from `other` sets.
+
+        Entries of a compatible NGram are subtracted from the posting lists
+        directly.
 
         >>> n = NGram(['spam', 'eggs'])
         >>> other = set(['spam'])
         >>> n.difference_update(other)
         >>> n
         NGram(['eggs'])
+        >>> n.difference_update(NGram(['eggs', 'ham']))
+        >>> n, n.length
+        (NGram([]), {})
         """
-        for x in other:
-            self.discard(x)
+        for other in others:
+            self._remove_items([x for x in other if x in self], other)
 
-    def intersection_update(self, other):
-        """Update the set with the intersection of itself and `other`.
+    def intersection_update(self, *others):
+        """Update the set with the intersection of itself and `other` sets.
 
         >>> n = NGram(['spam', 'eggs'])
         >>> other = set(['spam', 'ham'])
@@ -225,32 +620,132 @@ class NGram(set, NGramAbstract):
         >>> n
         NGram(['spam'])
         """
-        self.difference_update([x for x in self if x not in other])
+        for other in others:
+            if not isinstance(other, (set, frozenset)):
+                other = set(other)
+            self._remove_items([x for x in self if x not in other], self)
 
     def symmetric_difference_update(self, other):
         """Update the set with the symmetric difference of itself and `other`.
 
         >>> n = NGram(['spam', 'eggs'])
         >>> other = set(['spam', 'ham'])
-        >>> n.intersection_update(other)
+        >>> n.symmetric_difference_update(other)
         >>> n
+        NGram(['eggs', 'ham'])
+        """
+        if not isinstance(other, (set, frozenset)):
+            other = set(other)
+        common = [x for x in other if x in self]
+        added = set(x for x in other if x not in self)
+        self._remove_items(common, other)
+        if self._compatible(other):
+            self._merge(other, added)
+        else:
+            for item in added:
+                self.add(item)
+
+    def union(self, *others):
+        """Return a new index with the items of this one and `others`.
+
+        >>> NGram(['spam']).union(['eggs'], NGram(['ham']))
+        NGram(['eggs', 'ham', 'spam'])
+        """
+        result = self.copy()
+        for other in others:
+            result.update(other)
+        return result
+
+    def intersection(self, *others):
+        """Return a new index with the items common to this one and `others`.
+
+        >>> NGram(['spam', 'eggs']) & NGram(['spam', 'ham'])
         NGram(['spam'])
         """
-        intersection = self.intersection(other) # record intersection of sets
-        self.update(other) # add items present in other
-        self.difference_update(self, intersection) # remove items present in both
+        result = self.copy()
+        result.intersection_update(*others)
+        return result
+
+    def difference(self, *others):
+        """Return a new index with the items of this one not in `others`.
+
+        >>> NGram(['spam', 'eggs']) - NGram(['spam', 'ham'])
+        NGram(['eggs'])
+        """
+        result = self.copy()
+        result.difference_update(*others)
+        return result
 
+    def symmetric_difference(self, other):
+        """Return a new index with the items in exactly one of this one and
+        `other`.
+
+        >>> NGram(['spam', 'eggs']) ^ NGram(['spam', 'ham'])
+        NGram(['eggs', 'ham'])
+        """
+        result = self.copy()
+        result.symmetric_difference_update(other)
+        return result
+
+    def _operator(method):
+        """Binary set operator calling `method`, for operands that are sets."""
+        def operator(self, other):
+            if not isinstance(other, (set, frozenset)):
+                return NotImplemented
+            result = method(self, other)
+            return self if result is None else result
+        operator.__name__ = method.__name__
+        return operator
+
+    __or__ = _operator(union)
+    __and__ = _operator(intersection)
+    __sub__ = _operator(difference)
+    __xor__ = _operator(symmetric_difference)
+    __ior__ = _operator(lambda self, other: self.update(other))
+    __iand__ = _operator(intersection_update)
+    __isub__ = _operator(difference_update)
+    __ixor__ = _operator(symmetric_difference_update)
+    del _operator
 
     def update(self, items):
         """Update the set with new items.
 
+        With `gram_ids`, the n-gram ids of each batch of items are computed
+        at once by `ngram_vector.batch_gram_ids`.
+
+        The items of a compatible NGram are added by merging its posting lists
+        and lengths, without splitting the items again.
+
         >>> n = NGram(["spam"])
         >>> n.update(["eggs"])
         >>> n
         NGram(['eggs', 'spam'])
+        >>> n.update(NGram(["ham", "spam"]))
+        >>> n.search("ham", threshold=0.5)
+        [('ham', 1.0)]
         """
-        for item in items:
-            self.add(item)
+        if self._compatible(items):
+            self._merge(items, set(items).difference(self))
+            return
+        if self.gram_ids is None:
+            for item in items:
+                self.add(item)
+            return
+        items = iter(items)
+        while True:
+            batch = list(islice(items, _BATCH_SIZE))
+            if not batch:
+                return
+            new = []
+            seen = set()
+            for item in batch:
+                if item not in self and item not in seen:
+                    seen.add(item)
+                    new.append(item)
+            padded = [self.pad(self.key(item)) for item in new]
+            for item, string, ngrams in zip(new, padded,
+                                            batch_gram_ids(self, padded)):
+                self._add_grams(item, len(string), ngrams)
 
     def discard(self, item):
         """If `item` is a member of the set, remove it.
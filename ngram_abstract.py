@@ -22,6 +22,12 @@ Lesser General Public License for more details.
 See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
 """
 
+import time
+
+# Modulus and base of the rolling hash for hashed gram ids
+_HASH_PRIME = (1 << 61) - 1
+_HASH_BASE = 1000003
+
 class NGramAbstract(object):
     """A set that supports lookup by NGram string similarity.
 
@@ -66,8 +72,23 @@ class NGramAbstract(object):
 
     :ivar length: maps items to length of the padded string representations as
     ``{item:int, ...}``.
+
+    :ivar search_hook: None, or a function called after every search with a\
+    dictionary of counters for that search: the ``query``, number of n-grams\
+    split from it (``grams``), posting list entries scanned\
+    (``postings_scanned``), candidate items generated (``candidates``),\
+    candidates scored (``scored``), candidates passing the threshold\
+    (``matched``), query n-grams skipped as stop-grams (``pruned``), and the\
+    wall time in seconds of candidate generation\
+    (``candidate_seconds``), scoring (``score_seconds``) and the whole search\
+    (``total_seconds``).  When None, searches are not instrumented.
     """
 
+    search_hook = None
+
+    # How n-grams are keyed in the index, see `NGram`
+    gram_ids = None
+
     def __init__(self, items=[], threshold=0.0, warp=1.0, key=None,
                     N=3, pad_len=None, pad_char='$'):
         super(NGramAbstract, self).__init__()
@@ -123,6 +144,65 @@ class NGramAbstract(object):
         for i in range(len(string) - self.N + 1):
             yield string[i:i+self.N]
 
+    def _gram_ids(self, padded, query=False):
+        """Iterates over the index keys of the n-grams of a padded string:
+        the n-grams themselves, or their integer ids with `gram_ids`.
+
+        :param query: whether the string is a query rather than an item to\
+        index.  A query n-gram that does not fit packed ids cannot be in the\
+        index, so it gets the id -1 instead of raising ValueError.
+
+        >>> from ngram import NGram
+        >>> list(NGram()._gram_ids('hamham'))
+        ['ham', 'amh', 'mha', 'ham']
+        >>> ids = list(NGram(gram_ids='packed')._gram_ids('hamham'))
+        >>> ids[0] == ids[3] == (ord('h') << 42) | (ord('a') << 21) | ord('m')
+        True
+        >>> ids = list(NGram(gram_ids='hashed')._gram_ids('hamham'))
+        >>> ids[0] == ids[3], len(set(ids))
+        (True, 3)
+        >>> list(NGram(gram_ids='packed', N=4)._gram_ids(u'$a\\U0001F600', True))
+        [-1]
+        """
+        if self.gram_ids is None:
+            return self._split(padded)
+        elif self.gram_ids == 'packed':
+            return self._packed_ids(padded, query)
+        return self._hashed_ids(padded)
+
+    def _packed_ids(self, padded, query=False):
+        """Exact ids packing the code points of each n-gram."""
+        N = self.N
+        bits = 64 // N
+        limit = 1 << bits
+        mask = (1 << (bits * N)) - 1
+        code = 0
+        unfit = -N # position of the last character that does not fit
+        for i, char in enumerate(padded):
+            point = ord(char)
+            if point >= limit:
+                if not query:
+                    raise ValueError("Character %r does not fit packed "
+                                     "gram_ids with N=%d, use 'hashed'" %
+                                     (char, N))
+                unfit, point = i, 0
+            code = ((code << bits) | point) & mask
+            if i >= N - 1:
+                yield code if i - unfit >= N else -1
+
+    def _hashed_ids(self, padded):
+        """Rabin-Karp rolling hash of each n-gram modulo a Mersenne prime."""
+        N = self.N
+        prime = _HASH_PRIME
+        high = pow(_HASH_BASE, N - 1, prime)
+        code = 0
+        for i, char in enumerate(padded):
+            if i >= N:
+                code -= ord(padded[i - N]) * high
+            code = (code * _HASH_BASE + ord(char)) % prime
+            if i >= N - 1:
+                yield code
+
     def split(self, string):
         """Pads a string and iterates over its ngrams.
 
@@ -145,7 +225,7 @@ class NGramAbstract(object):
     def add(self, item):
         pass
 
-    def items_sharing_ngrams(self, query):
+    def items_sharing_ngrams(self, query, stats=None):
         pass
 
     def get_item_length(self, match):
@@ -164,8 +244,10 @@ class NGramAbstract(object):
         >>> n = NGram([(0, "SPAM"), (1, "SPAN"), (2, "EG")], key=lambda x:x[1])
         >>> n.searchitem((2, "SPA"))
         [((0, 'SPAM'), 0.375), ((1, 'SPAN'), 0.375)]
+        >>> n.searchitem((2, "SPAM"), threshold=0.5)
+        [((0, 'SPAM'), 1.0)]
         """
-        return self.search(self.key(item))
+        return self.search(self.key(item), threshold)
 
     def search(self, query, threshold=None):
         """Search the index for items whose key exceeds threshold
@@ -184,13 +266,75 @@ class NGramAbstract(object):
         [((0, 'SPAM'), 0.125)]
         >>> n.search("EG")
         [((2, 'EG'), 1.0)]
+        >>> import sys
+        >>> n.search_hook = lambda stats: sys.stdout.write("%(grams)d grams, "
+        ...     "%(postings_scanned)d postings, %(candidates)d candidates, "
+        ...     "%(matched)d matched\\n" % stats)
+        >>> n.search("SPA")
+        5 grams, 6 postings, 2 candidates, 2 matched
+        [((0, 'SPAM'), 0.375), ((1, 'SPAN'), 0.375)]
+        """
+        hook = self.search_hook
+        if hook is None:
+            return self.rank_candidates(
+                query, self.items_sharing_ngrams(query), threshold)
+        stats = self._new_stats(query)
+        start = time.time()
+        shared = self.items_sharing_ngrams(query, stats)
+        middle = time.time()
+        results = self.rank_candidates(query, shared, threshold)
+        end = time.time()
+        stats.update(candidates=len(shared), scored=len(shared),
+                     matched=len(results), candidate_seconds=middle - start,
+                     score_seconds=end - middle, total_seconds=end - start)
+        hook(stats)
+        return results
+
+    @staticmethod
+    def _new_stats(query):
+        """Return zeroed counters for `search_hook`."""
+        return dict(query=query, grams=0, postings_scanned=0, candidates=0,
+                    scored=0, matched=0, pruned=0, candidate_seconds=0.0,
+                    score_seconds=0.0, total_seconds=0.0)
+
+    def search_batch(self, queries, threshold=None):
+        """Search the index for each of several query strings.
+
+        Backends that pay a round trip per lookup override this to fetch the
+        n-grams of all the queries at once.
+
+        :return: list with the result of `search` for each query.
+
+        >>> from ngram import NGram
+        >>> n = NGram(["ham", "spam", "eggs"])
+        >>> n.search_batch(["ham", "egg"], threshold=0.3)
+        [[('ham', 1.0)], [('eggs', 0.375)]]
+        """
+        return [self.search(query, threshold) for query in queries]
+
+    def rank_candidates(self, query, shared, threshold=None, lengths=None):
+        """Score the items sharing n-grams with the query and rank them.
+
+        :param shared: dictionary from item to number of shared n-grams, as\
+        returned by `items_sharing_ngrams`.
+
+        :param lengths: optional dictionary from item to padded length, used\
+        instead of `get_item_length` when provided.
+
+        :return: list of pairs of (item, similarity) by decreasing similarity.
+
+        >>> from ngram import NGram
+        >>> n = NGram(["ham", "spam", "eggs"])
+        >>> n.rank_candidates("mam", {'ham': 2, 'spam': 2})
+        [('ham', 0.25), ('spam', 0.2222222222222222)]
         """
         threshold = threshold if threshold is not None else self.threshold
         results = []
-        # Identify possible results
-        for match, samegrams in self.items_sharing_ngrams(query).iteritems():
-            allgrams = (len(self.pad(query)) + self.get_item_length(match)
-                    - (2 * self.N) - samegrams + 2)
+        querylen = len(self.pad(query))
+        for match, samegrams in shared.iteritems():
+            itemlen = (lengths[match] if lengths is not None
+                       else self.get_item_length(match))
+            allgrams = querylen + itemlen - (2 * self.N) - samegrams + 2
             similarity = self._similarity(samegrams, allgrams, self.warp)
             if similarity >= threshold:
                 results.append((match, similarity))
@@ -262,3 +406,36 @@ class NGramAbstract(object):
             similarity = (allgrams**warp - diffgrams**warp) / (allgrams**warp)
         return similarity
 
+
+def _summary(values):
+    """Summarize a distribution of numbers.
+
+    :return: dictionary of the ``min``, ``median``, ``p99``, ``max`` and\
+    ``mean`` of the values, all 0 when there are none.
+
+    >>> sorted(_summary([4, 1, 3, 2, 100]).items())
+    [('max', 100), ('mean', 22.0), ('median', 3), ('min', 1), ('p99', 4)]
+    """
+    values = sorted(values)
+    if not values:
+        return dict(min=0, median=0, p99=0, max=0, mean=0.0)
+    last = len(values) - 1
+    return dict(min=values[0], median=values[last // 2],
+                p99=values[int(last * 0.99)], max=values[-1],
+                mean=sum(values) / len(values))
+
+class SearchResults(list):
+    """List of (item, similarity) pairs returned by a search, flagged with
+    whether it may be missing matches.
+
+    :ivar complete: False when the search did not cover the whole index, for\
+    instance one still being built, so that matching items may be missing.
+
+    >>> results = SearchResults([('spam', 0.5)], complete=False)
+    >>> results, results.complete
+    ([('spam', 0.5)], False)
+    """
+
+    def __init__(self, results=(), complete=True):
+        list.__init__(self, results)
+        self.complete = complete
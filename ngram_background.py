@@ -0,0 +1,190 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import sys
+import threading
+from itertools import islice
+
+from ngram import NGram
+from ngram_abstract import SearchResults
+
+class BackgroundNGram(object):
+    """Builds an index on a background thread, so that a service can start
+    answering before all its items are indexed.
+
+    Searches wait for the build to finish, unless `partial` is set, in which
+    case they search the items indexed so far and their results have
+    ``complete`` False.  A finished index is never modified again: `rebuild`
+    builds a replacement alongside it, and swaps it in when done.
+
+    :param items: iteration of items to index.
+
+    :param partial: whether to search a partially built index rather than\
+    wait for the build to finish.
+
+    :type batch_size: int >= 1
+
+    :param batch_size: number of items indexed between searches of a\
+    partially built index.
+
+    :param index_type: class of the index to build, `NGram` by default.
+
+    :param params: other keyword arguments for `index_type`, such as\
+    `threshold`, `key` or `N`.
+
+    Instance variables:
+
+    :ivar indexed: number of items indexed by the current build so far.
+
+    :ivar total: number of items in the current build, or None when the\
+    items have no length.
+
+    >>> n = BackgroundNGram(["ham", "spam", "eggs"], N=2)
+    >>> n.wait()
+    True
+    >>> n.search("ham")
+    [('ham', 1.0), ('spam', 0.2857142857142857)]
+    >>> n.indexed, n.total
+    (3, 3)
+    """
+
+    def __init__(self, items=[], partial=False, batch_size=10000,
+                 index_type=NGram, **params):
+        if not batch_size >= 1:
+            raise ValueError("Require batch_size >= 1, not: " + str(batch_size))
+        self.partial = partial
+        self.batch_size = batch_size
+        self.index_type = index_type
+        self.params = params
+        # The finished index being served, and the one under construction
+        self._index = None
+        self._building = None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._done = None
+        self._error = None
+        self.rebuild(items)
+
+    @property
+    def index(self):
+        """The most recently finished index, or None before the first build
+        has finished."""
+        return self._index
+
+    def is_ready(self):
+        """Whether a finished index is being searched."""
+        return self._index is not None
+
+    def rebuild(self, items):
+        """Start building a new index of `items` in the background, replacing
+        the current one when finished.  Until then, searches use the current
+        index.  Abandons any build still in progress.
+        """
+        index = self.index_type([], **self.params)
+        done = threading.Event()
+        with self._lock:
+            self._generation += 1
+            self._building = index
+            self._done = done
+            self._error = None
+            self.indexed = 0
+            self.total = len(items) if hasattr(items, '__len__') else None
+        thread = threading.Thread(target=self._build,
+                                  args=(self._generation, index, items, done))
+        thread.daemon = True
+        thread.start()
+
+    def _build(self, generation, index, items, done):
+        try:
+            items = iter(items)
+            while True:
+                batch = list(islice(items, self.batch_size))
+                if not batch:
+                    break
+                with self._lock:
+                    if generation != self._generation:
+                        return # abandoned by a later rebuild
+                    index.update(batch)
+                    self.indexed += len(batch)
+            with self._lock:
+                if generation == self._generation:
+                    self._index = index
+                    self._building = None
+        except Exception:
+            with self._lock:
+                if generation == self._generation:
+                    self._error = sys.exc_info()
+        finally:
+            done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the current build to finish, re-raising any error that
+        stopped it.
+
+        :param timeout: maximum seconds to wait, or None to wait until done.
+
+        :return: whether a finished index is ready.
+        """
+        self._done.wait(timeout)
+        error = self._error
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return self.is_ready()
+
+    def _search(self, search):
+        """Apply ``search(index)`` to the finished index, or to the partial
+        one when allowed, returning `SearchResults`."""
+        index = self._index
+        if index is None and self.partial:
+            with self._lock:
+                if self._index is None and self._building is not None:
+                    return SearchResults(search(self._building), complete=False)
+            index = self._index
+        while index is None: # until a build finishes, even if rebuilt meanwhile
+            self.wait()
+            index = self._index
+        return SearchResults(search(index))
+
+    def search(self, query, threshold=None):
+        """Search the index, see `NGram.search`.
+
+        :return: `SearchResults` of pairs of (item, similarity) by\
+        decreasing similarity.
+        """
+        return self._search(lambda index: index.search(query, threshold))
+
+    def searchitem(self, item, threshold=None):
+        """Search the index for items similar to `item`, see
+        `NGram.searchitem`."""
+        return self._search(lambda index: index.searchitem(item, threshold))
+
+    def find(self, query, threshold=None):
+        """Return the best match to the query, or None on no match."""
+        results = self.search(query, threshold)
+        return results[0][0] if results else None
+
+    def finditem(self, item, threshold=None):
+        """Return the most similar item to `item`, or None on no match."""
+        results = self.searchitem(item, threshold)
+        return results[0][0] if results else None
@@ -0,0 +1,438 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import cPickle as pickle
+import time
+from array import array
+from bisect import bisect_left
+from itertools import islice, izip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ngram_abstract import NGramAbstract
+
+# Posting list blocks of at least this many bytes are decoded with NumPy
+_VECTOR_BYTES = 128
+
+def _compact(values):
+    """Array of non-negative integers with the smallest typecode that holds
+    them all."""
+    maximum = max(values) if values else 0
+    for code in 'BHIL':
+        if maximum < (1 << (8 * array(code).itemsize)):
+            return array(code, values)
+    raise OverflowError("Value too large for an array: %d" % maximum)
+
+class FrozenNGram(NGramAbstract):
+    """A read-only NGram index compiled into contiguous arrays, produced by
+    `NGram.freeze`.  Searches give the same results as the NGram it was
+    frozen from.
+
+    The posting lists are stored in compressed sparse row form: the entries
+    of the n-gram in row ``r`` of the gram table are at positions
+    ``offsets[r]`` to ``offsets[r+1]`` of the ``item_ids`` and ``counts``
+    arrays, and items are referred to by their position in a tuple.  This
+    takes a fraction of the memory of the nested dictionaries of NGram,
+    pickles and loads without re-indexing, and since searches never write to
+    the index it can be shared between threads, and between forked processes
+    without the arrays being copied.
+
+    Instance variables:
+
+    :ivar _rows: maps each n-gram (or its integer id) to its row.
+
+    :ivar _offsets: array of ``len(_rows) + 1`` posting list boundaries.
+
+    :ivar _item_ids: array of item positions of all posting lists.
+
+    :ivar _counts: array of the occurrences of the n-gram in each posted item.
+
+    :ivar _items: tuple of the items.
+
+    :ivar _lengths: array of padded lengths of the items.
+
+    :ivar max_df: the stop-gram cap of the NGram, see `NGram`.
+    """
+
+    def __init__(self, threshold=0.0, warp=1.0, key=None, N=3, pad_len=None,
+                 pad_char='$', gram_ids=None, items=(), lengths=None,
+                 rows=None, offsets=None, item_ids=None, counts=None,
+                 max_df=None):
+        super(FrozenNGram, self).__init__([], threshold, warp, key, N,
+                pad_len, pad_char)
+        self.gram_ids = gram_ids
+        self.max_df = max_df
+        self._items = tuple(items)
+        self._lengths = lengths if lengths is not None else array('B')
+        self._rows = rows if rows is not None else {}
+        self._offsets = offsets if offsets is not None else array('B', [0])
+        self._item_ids = item_ids if item_ids is not None else array('B')
+        self._counts = counts if counts is not None else array('B')
+
+    # Arrays holding the compiled index, saved by pickling
+    _ARRAYS = ('lengths', 'offsets', 'item_ids', 'counts')
+
+    @classmethod
+    def from_ngram(cls, index):
+        """Compile the posting lists of an NGram.
+
+        >>> from ngram import NGram
+        >>> n = NGram(["ham", "spam", "eggs"]).freeze()
+        >>> n
+        FrozenNGram(['eggs', 'ham', 'spam'])
+        >>> n.search("mam")
+        [('ham', 0.25), ('spam', 0.2222222222222222)]
+        >>> n = NGram(["spam", "spat", "spin", "ham"], max_df=0.5).freeze()
+        >>> n.search("spam")
+        [('spam', 1.0), ('spat', 0.3333333333333333), ('ham', 0.2222222222222222)]
+        """
+        items = sorted(index)
+        ids = dict((item, i) for i, item in enumerate(items))
+        rows = {}
+        postings = []
+        for ngram, posting in index._grams.iteritems():
+            if not posting:
+                continue
+            rows[ngram] = len(rows)
+            postings.append(sorted((ids[item], count)
+                                   for item, count in posting.iteritems()))
+        arrays = cls._compile(postings)
+        arrays['lengths'] = _compact([index.length[item] for item in items])
+        return cls(index.threshold, index.warp, index._key, index.N,
+                   index._pad_len, index._pad_char, index.gram_ids, items,
+                   rows=rows, max_df=index.max_df, **arrays)
+
+    @staticmethod
+    def _compile(postings):
+        """Arrays for the posting lists, given for each row the sorted list
+        of (item position, count)."""
+        offsets = [0]
+        item_ids = []
+        counts = []
+        for posting in postings:
+            for item_id, count in posting:
+                item_ids.append(item_id)
+                counts.append(count)
+            offsets.append(len(item_ids))
+        return dict(offsets=_compact(offsets), item_ids=_compact(item_ids),
+                    counts=_compact(counts))
+
+    def _row(self, row):
+        """Item positions and counts of the posting list in a row."""
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return self._item_ids[start:end], self._counts[start:end]
+
+    def _row_size(self, row):
+        """Number of items in the posting list in a row."""
+        return self._offsets[row + 1] - self._offsets[row]
+
+    def __reduce__(self):
+        """Return state information for pickling, storing the arrays as raw
+        bytes so that unpickling does not re-index the items.  The key
+        function must be None, a builtin function, or a named module-level
+        function.
+
+        >>> from ngram import NGram
+        >>> import pickle
+        >>> n = pickle.loads(pickle.dumps(NGram(["ham", "spam"]).freeze()))
+        >>> n.search("ham")
+        [('ham', 1.0), ('spam', 0.2222222222222222)]
+        """
+        arrays = [(name, getattr(self, '_' + name).typecode,
+                   getattr(self, '_' + name).tostring())
+                  for name in self._ARRAYS]
+        return _unpickle, (type(self), (self.threshold, self.warp, self._key,
+                            self.N, self._pad_len, self._pad_char,
+                            self.gram_ids), self._items, self._rows, arrays,
+                            self.max_df)
+
+    def dump(self, f, protocol=pickle.HIGHEST_PROTOCOL):
+        """Write the index to an open binary file, for `load`."""
+        pickle.dump(self, f, protocol)
+
+    @classmethod
+    def load(cls, f):
+        """Read an index written by `dump` from an open binary file."""
+        return pickle.load(f)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, item):
+        return self._item_id(item) is not None
+
+    def _item_id(self, item):
+        """Position of an item, looked up in the shortest posting list of
+        its n-grams, or None if the item is not in the index."""
+        best = None
+        for ngram in self._gram_ids(self.pad(self.key(item)), True):
+            row = self._rows.get(ngram)
+            if row is None:
+                return None
+            size = self._row_size(row)
+            if best is None or size < best[1]:
+                best = row, size
+        if best is None:
+            return None
+        for item_id in self._row(best[0])[0]:
+            if self._items[item_id] == item:
+                return item_id
+        return None
+
+    def add(self, item):
+        raise TypeError("FrozenNGram is read-only")
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def get_item_length(self, match):
+        return self._lengths[self._item_id(match)]
+
+    def _df_cap(self):
+        """Number of items above which an n-gram is a stop-gram, or None."""
+        if self.max_df is None or isinstance(self.max_df, (int, long)):
+            return self.max_df
+        return self.max_df * len(self)
+
+    def _shared_ids(self, query, stats=None):
+        """Count the n-grams shared with the query per item position.  As
+        in `NGram`, stop-grams only complete the counts of the items found
+        through the other n-grams."""
+        rows = self._rows
+        cap = self._df_cap()
+        wanted = {}
+        for ngram in self._gram_ids(self.pad(query), True):
+            if stats is not None:
+                stats['grams'] += 1
+            row = rows.get(ngram)
+            if row is not None:
+                wanted[row] = wanted.get(row, 0) + 1
+        skipped = []
+        if cap is not None:
+            for row, wanted_count in wanted.items():
+                if self._row_size(row) > cap:
+                    skipped.append((row, wanted_count))
+                    del wanted[row]
+                    if stats is not None:
+                        stats['pruned'] += wanted_count
+        shared = {}
+        for row, wanted_count in wanted.iteritems():
+            item_ids, counts = self._row(row)
+            if stats is not None:
+                stats['postings_scanned'] += len(item_ids)
+            if wanted_count == 1:
+                for item_id in item_ids:
+                    shared[item_id] = shared.get(item_id, 0) + 1
+                continue
+            for item_id, count in izip(item_ids, counts):
+                # match up to as many occurrences as exist in both strings
+                shared[item_id] = (shared.get(item_id, 0) +
+                                   min(wanted_count, count))
+        for row, wanted_count in skipped:
+            # Item positions are sorted within a posting list
+            item_ids, counts = self._row(row)
+            size = len(item_ids)
+            for item_id in shared:
+                i = bisect_left(item_ids, item_id)
+                if i < size and item_ids[i] == item_id:
+                    shared[item_id] += min(wanted_count, counts[i])
+        return shared
+
+    def items_sharing_ngrams(self, query, stats=None):
+        """Retrieve the subset of items that share n-grams the query string.
+
+        :param query: look up items that share N-grams with this string.
+        :return: dictionary from matched string to the number of shared N-grams.
+
+        >>> from ngram import NGram
+        >>> n = NGram(["ham","spam","eggs"]).freeze()
+        >>> n.items_sharing_ngrams("mam")
+        {'ham': 2, 'spam': 2}
+        """
+        items = self._items
+        return dict((items[item_id], count) for item_id, count in
+                    self._shared_ids(query, stats).iteritems())
+
+    def search(self, query, threshold=None):
+        """Search the index for items whose key exceeds threshold
+        similarity to the query string.
+
+        :return: list of pairs of (item, similarity) by decreasing similarity.
+
+        >>> from ngram import NGram
+        >>> n = NGram([(0, "SPAM"), (1, "SPAN"), (2, "EG")], key=lambda x:x[1])
+        >>> sorted(n.freeze().search("SPA"))
+        [((0, 'SPAM'), 0.375), ((1, 'SPAN'), 0.375)]
+        """
+        hook = self.search_hook
+        stats = self._new_stats(query) if hook is not None else None
+        start = time.time()
+        shared_ids = self._shared_ids(query, stats)
+        items = self._items
+        lengths = self._lengths
+        shared = {}
+        item_lengths = {}
+        for item_id, count in shared_ids.iteritems():
+            shared[items[item_id]] = count
+            item_lengths[items[item_id]] = lengths[item_id]
+        middle = time.time()
+        results = self.rank_candidates(query, shared, threshold, item_lengths)
+        if hook is not None:
+            end = time.time()
+            stats.update(candidates=len(shared), scored=len(shared),
+                         matched=len(results), candidate_seconds=middle - start,
+                         score_seconds=end - middle, total_seconds=end - start)
+            hook(stats)
+        return results
+
+class CompressedNGram(FrozenNGram):
+    """A `FrozenNGram` whose posting lists are compressed, produced by
+    ``NGram.freeze(compress=True)``.  Searches give the same results as the
+    NGram it was frozen from.
+
+    The posting list of each n-gram is a block of varints in one byte
+    array: the number of items, then for each item in increasing order of
+    position the gap from the previous position shifted left by one bit,
+    with the low bit set when the item contains the n-gram more than once,
+    and finally the counts of those items.  Most gaps and counts fit in a
+    byte, and most counts are one and cost nothing.  Blocks are decoded
+    whole when searched, with NumPy for long blocks when it is installed.
+
+    :ivar _data: array of bytes of all the posting list blocks.
+
+    :ivar _offsets: array of ``len(_rows) + 1`` block boundaries in `_data`.
+    """
+
+    _ARRAYS = ('lengths', 'offsets', 'data')
+
+    def __init__(self, threshold=0.0, warp=1.0, key=None, N=3, pad_len=None,
+                 pad_char='$', gram_ids=None, items=(), lengths=None,
+                 rows=None, offsets=None, data=None, max_df=None):
+        super(CompressedNGram, self).__init__(threshold, warp, key, N,
+                pad_len, pad_char, gram_ids, items, lengths, rows, offsets,
+                max_df=max_df)
+        self._data = data if data is not None else array('B')
+
+    @staticmethod
+    def _compile(postings):
+        """Encode the posting lists as varint blocks.
+
+        >>> CompressedNGram._compile([[(0, 1), (3, 2), (300, 1)]])['data']
+        array('B', [3, 0, 7, 210, 4, 2])
+        """
+        data = array('B')
+        offsets = [0]
+        for posting in postings:
+            _varint(len(posting), data)
+            previous = 0
+            for item_id, count in posting:
+                _varint((item_id - previous) << 1 | (count > 1), data)
+                previous = item_id
+            for _, count in posting:
+                if count > 1:
+                    _varint(count, data)
+            offsets.append(len(data))
+        return dict(offsets=_compact(offsets), data=data)
+
+    def _row(self, row):
+        start, end = self._offsets[row], self._offsets[row + 1]
+        if numpy is not None and end - start >= _VECTOR_BYTES:
+            return _vector_row(self._data, start, end)
+        values = _varints(self._data, start, end)
+        size = values[0]
+        item_ids = []
+        counts = []
+        item_id = 0
+        extra = size + 1
+        for value in islice(values, 1, size + 1):
+            item_id += value >> 1
+            item_ids.append(item_id)
+            if value & 1:
+                counts.append(values[extra])
+                extra += 1
+            else:
+                counts.append(1)
+        return item_ids, counts
+
+    def _row_size(self, row):
+        data = self._data
+        start = self._offsets[row]
+        return _varints(data, start, start + 10, 1)[0]
+
+def _varint(value, data):
+    """Append the little-endian base 128 encoding of a value to data."""
+    while value >= 128:
+        data.append(value & 127 | 128)
+        value >>= 7
+    data.append(value)
+
+def _varints(data, start, end, limit=None):
+    """Decode the varints between two positions of data, or only the first
+    `limit` of them."""
+    values = []
+    value = shift = 0
+    for i in xrange(start, min(end, len(data))):
+        byte = data[i]
+        value |= (byte & 127) << shift
+        if byte < 128:
+            values.append(value)
+            if len(values) == limit:
+                break
+            value = shift = 0
+        else:
+            shift += 7
+    return values
+
+def _vector_row(data, start, end):
+    """Decode a posting list block with NumPy."""
+    block = numpy.frombuffer(data, dtype=numpy.uint8, count=end - start,
+                             offset=start)
+    last = numpy.flatnonzero(block < 128)
+    first = numpy.concatenate(([0], last[:-1] + 1))
+    # Shift each byte by 7 bits per byte before it in its varint
+    shifts = 7 * (numpy.arange(len(block)) - numpy.repeat(first, last - first + 1))
+    values = numpy.add.reduceat((block & 127).astype(numpy.uint64) <<
+                                shifts.astype(numpy.uint64), first)
+    size = int(values[0])
+    gaps = values[1:size + 1]
+    counts = numpy.ones(size, dtype=numpy.uint64)
+    counts[(gaps & numpy.uint64(1)).astype(bool)] = values[size + 1:]
+    return (numpy.cumsum(gaps >> numpy.uint64(1)).tolist(), counts.tolist())
+
+def _unpickle(cls, params, items, rows, arrays, max_df=None):
+    compiled = {}
+    for name, typecode, data in arrays:
+        compiled[name] = array(typecode)
+        compiled[name].fromstring(data)
+    return cls(*params, items=items, rows=rows, max_df=max_df, **compiled)
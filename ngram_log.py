@@ -0,0 +1,252 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import cPickle as pickle
+import os
+import struct
+import zlib
+
+from ngram import NGram
+
+# Record header: length and CRC-32 of the pickled (operation, items)
+_HEADER = struct.Struct('<II')
+_ADD, _REMOVE = 'a', 'r'
+
+class LoggedNGram(object):
+    """An NGram persisted to a directory as a snapshot of the index and an
+    append-only log of the additions and removals made since, so that it
+    survives crashes and restarts without pickling the whole set on every
+    change or re-indexing it on every load.
+
+    Opening the directory loads the snapshot, written by `NGram.dump`, and
+    replays the log over it.  Each log record carries a checksum, and a
+    record torn by a crash while it was being written is dropped.  A change
+    survives a crash of the process once its method returns, and a crash
+    of the machine once the log is synced to disk, see `sync_every`.
+
+    `checkpoint` writes a new snapshot and empties the log, and runs by
+    itself every `checkpoint_every` changes.  A crash during a checkpoint
+    leaves either the old snapshot and the whole log, or the new snapshot
+    and a log whose replay over it changes nothing.
+
+    :param path: directory holding the snapshot and log, created if missing.
+
+    :type sync_every: int >= 0
+
+    :param sync_every: sync the log to disk with `os.fsync` after this many\
+    changes, or only on `sync`, `checkpoint` and `close` when 0.  Syncing\
+    costs a disk flush, so larger values trade durability on a machine\
+    crash for speed.
+
+    :type checkpoint_every: int >= 1 or None
+
+    :param checkpoint_every: number of logged changes after which a\
+    checkpoint is made, or None to checkpoint only when called.
+
+    :param params: keyword arguments of a new `NGram`, such as `threshold`\
+    or `key`, used when the directory has no snapshot yet.  They are kept\
+    in the snapshot, so the key function must be picklable.
+
+    >>> import shutil, tempfile
+    >>> path = tempfile.mkdtemp()
+    >>> n = LoggedNGram(path, N=2)
+    >>> n.update(["ham", "spam", "eggs"])
+    >>> n.remove("eggs")
+    >>> n.close()
+    >>> n = LoggedNGram(path)
+    >>> n.index
+    NGram(['ham', 'spam'])
+    >>> n.search("ham")
+    [('ham', 1.0), ('spam', 0.2857142857142857)]
+    >>> n.close()
+    >>> shutil.rmtree(path)
+    """
+
+    def __init__(self, path, sync_every=1, checkpoint_every=None, **params):
+        if not sync_every >= 0:
+            raise ValueError("Require sync_every >= 0, not: " + str(sync_every))
+        if checkpoint_every is not None and not checkpoint_every >= 1:
+            raise ValueError("Require checkpoint_every >= 1, not: " +
+                             str(checkpoint_every))
+        self.path = path
+        self.sync_every = sync_every
+        self.checkpoint_every = checkpoint_every
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._snapshot = os.path.join(path, 'snapshot')
+        self._log_path = os.path.join(path, 'log')
+        if os.path.exists(self._snapshot):
+            with open(self._snapshot, 'rb') as f:
+                self.index = NGram.load(f)
+        else:
+            # Keep the parameters even if nothing is ever checkpointed
+            self.index = NGram(**params)
+            self._write_snapshot()
+        # Changes logged since the last checkpoint and since the last sync
+        self.logged = self._replay()
+        self._unsynced = 0
+        self._log = open(self._log_path, 'ab')
+
+    def _replay(self):
+        """Apply the log to the index, truncating any torn final record.
+
+        :return: number of records replayed.
+        """
+        if not os.path.exists(self._log_path):
+            return 0
+        index = self.index
+        records = 0
+        with open(self._log_path, 'r+b') as f:
+            good = 0
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if (len(payload) < length or
+                    zlib.crc32(payload) & 0xffffffff != crc):
+                    break
+                op, items = pickle.loads(payload)
+                if op == _ADD:
+                    index.update(items)
+                else:
+                    for item in items:
+                        index.discard(item)
+                records += 1
+                good = f.tell()
+            if good < os.fstat(f.fileno()).st_size:
+                f.truncate(good)
+        return records
+
+    def _append(self, op, items):
+        payload = pickle.dumps((op, items), pickle.HIGHEST_PROTOCOL)
+        self._log.write(_HEADER.pack(len(payload),
+                                     zlib.crc32(payload) & 0xffffffff))
+        self._log.write(payload)
+        self._log.flush()
+        self.logged += 1
+        self._unsynced += 1
+        if self.checkpoint_every is not None and \
+           self.logged >= self.checkpoint_every:
+            self.checkpoint()
+        elif self.sync_every and self._unsynced >= self.sync_every:
+            self.sync()
+
+    def add(self, item):
+        """Add an item to the index and log it."""
+        self.index.add(item)
+        self._append(_ADD, [item])
+
+    def update(self, items):
+        """Add items to the index, logging them as a single record."""
+        items = list(items)
+        if items:
+            self.index.update(items)
+            self._append(_ADD, items)
+
+    def remove(self, item):
+        """Remove an item from the index and log it.  Like `NGram.remove`,
+        an item not in the index is ignored."""
+        self.discard(item)
+
+    def discard(self, item):
+        """Remove an item from the index and log it, if it is present."""
+        if item in self.index:
+            self.index.remove(item)
+            self._append(_REMOVE, [item])
+
+    def sync(self):
+        """Sync the log to disk."""
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._unsynced = 0
+
+    def checkpoint(self):
+        """Write a snapshot of the index, then empty the log.  The snapshot
+        replaces the previous one atomically."""
+        self._write_snapshot()
+        self._log.truncate(0)
+        self.sync()
+        self.logged = 0
+
+    def _write_snapshot(self):
+        temp = self._snapshot + '.tmp'
+        with open(temp, 'wb') as f:
+            self.index.dump(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp, self._snapshot)
+        _sync_directory(self.path)
+
+    def close(self):
+        """Sync and close the log.  The log is replayed on the next open,
+        so call `checkpoint` first to make that quick."""
+        if not self._log.closed:
+            self.sync()
+            self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def search(self, query, threshold=None, **budget):
+        """Search the index, see `NGram.search`."""
+        return self.index.search(query, threshold, **budget)
+
+    def searchitem(self, item, threshold=None):
+        """Search the index for items similar to `item`, see
+        `NGram.searchitem`."""
+        return self.index.searchitem(item, threshold)
+
+    def search_batch(self, queries, threshold=None):
+        """Search the index for each of several query strings."""
+        return self.index.search_batch(queries, threshold)
+
+    def find(self, query, threshold=None, **budget):
+        """Return the best match to the query, or None on no match."""
+        return self.index.find(query, threshold, **budget)
+
+    def finditem(self, item, threshold=None):
+        """Return the most similar item to `item`, or None on no match."""
+        return self.index.finditem(item, threshold)
+
+def _sync_directory(path):
+    """Sync a directory so that a rename within it survives a crash."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,259 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import random
+import sys
+import zlib
+
+from ngram import NGram
+from ngram_abstract import NGramAbstract, _summary
+
+# Mersenne prime modulus for the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+class NGramLSH(NGram):
+    """An NGram that finds candidates approximately, using MinHash signatures
+    of the n-gram sets of items bucketed by LSH banding, instead of posting
+    lists.  Candidates are scored exactly, so every result has its true
+    similarity, but some items above the threshold may be missed.
+
+    An item whose n-gram set has Jaccard similarity `s` with that of the
+    query becomes a candidate with probability ``1 - (1 - s**rows)**bands``.
+    More `bands` raise recall, more `rows` per band make candidates fewer and
+    searches faster.  The signature of an item costs ``bands * rows`` hash
+    evaluations per distinct n-gram.
+
+    :type bands: int >= 1
+
+    :param bands: number of LSH bands, each an independent chance to collide.
+
+    :type rows: int >= 1
+
+    :param rows: number of MinHash values per band.
+
+    :param seed: seed for the MinHash permutations.  Indexes only produce\
+    comparable signatures when they use the same seed.
+
+    Other parameters are as for `NGram`.
+
+    >>> n = NGramLSH(["joe", "joseph", "jon", "john", "sally"], bands=20, rows=2)
+    >>> n.search("jon", threshold=0.3)
+    [('jon', 1.0), ('john', 0.375)]
+    """
+
+    def __init__(self, items=[], threshold=0.0, warp=1.0, key=None,
+                    N=3, pad_len=None, pad_char='$', bands=16, rows=4, seed=0):
+        if not bands >= 1:
+            raise ValueError("Require bands >= 1, not: " + str(bands))
+        if not rows >= 1:
+            raise ValueError("Require rows >= 1, not: " + str(rows))
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        rnd = random.Random(seed)
+        self._permutations = [(rnd.randrange(1, _PRIME), rnd.randrange(_PRIME))
+                              for _ in range(bands * rows)]
+        # band key -> set of items, and item -> its band keys
+        self._buckets = {}
+        self._band_keys = {}
+        NGram.__init__(self, items, threshold, warp, key, N, pad_len, pad_char)
+
+    def __reduce__(self):
+        """Return state information for pickling, no references to this instance.
+
+        >>> import pickle
+        >>> pickle.loads(pickle.dumps(NGramLSH(['spam'], rows=2))).rows
+        2
+        """
+        return NGramLSH, (list(self), self.threshold, self.warp, self._key,
+                          self.N, self._pad_len, self._pad_char, self.bands,
+                          self.rows, self.seed)
+
+    def copy(self):
+        """Return a shallow copy of the NGramLSH object."""
+        return NGramLSH(self, self.threshold, self.warp, self._key, self.N,
+                        self._pad_len, self._pad_char, self.bands, self.rows,
+                        self.seed)
+
+    def dump(self, f, protocol=None):
+        """Refuse to dump, as there are no posting lists.  Pickle the
+        NGramLSH instead.
+
+        >>> NGramLSH(['spam']).dump(None)
+        Traceback (most recent call last):
+        ...
+        TypeError: NGramLSH has no posting lists to dump
+        """
+        raise TypeError("NGramLSH has no posting lists to dump")
+
+    @classmethod
+    def load(cls, f):
+        raise TypeError("NGramLSH has no posting lists to load")
+
+    def freeze(self, compress=False):
+        raise TypeError("NGramLSH has no posting lists to freeze")
+
+    def stats(self, top=10):
+        """Describe the size and shape of the index.  In place of the
+        posting lists of `NGram.stats`, these are the LSH buckets.
+
+        :param top: unused, for the signature of `NGram.stats`.
+
+        :return: dictionary of the number of ``items``, of non-empty\
+        ``buckets``, the ``bucket_sizes`` summary (``min``, ``median``,\
+        ``p99``, ``max`` and ``mean``), the ``mean_padded_length`` of the\
+        items, and a ``memory`` estimate in bytes of the ``buckets`` (the\
+        bucket table and sets), the ``band_keys`` of the items, the\
+        ``length`` dictionary, the ``item_set`` table and the ``items``\
+        themselves (shallow sizes), with their ``total``.
+
+        >>> n = NGramLSH(["spam", "spat", "ham"], bands=4, rows=1)
+        >>> info = n.stats()
+        >>> info['items'], info['buckets'] <= 12
+        (3, True)
+        >>> sorted(info['memory'])
+        ['band_keys', 'buckets', 'item_set', 'items', 'length', 'total']
+        """
+        memory = dict(
+            buckets=sys.getsizeof(self._buckets) +
+                sum(sys.getsizeof(bucket)
+                    for bucket in self._buckets.itervalues()),
+            band_keys=sys.getsizeof(self._band_keys) +
+                sum(sys.getsizeof(keys)
+                    for keys in self._band_keys.itervalues()),
+            length=sys.getsizeof(self.length),
+            item_set=set.__sizeof__(self),
+            items=sum(sys.getsizeof(item) for item in self))
+        memory['total'] = sum(memory.values())
+        return dict(items=len(self), buckets=len(self._buckets),
+                    bucket_sizes=_summary(len(bucket) for bucket
+                                          in self._buckets.itervalues()),
+                    mean_padded_length=_summary(
+                        self.length.itervalues())['mean'],
+                    memory=memory)
+
+    def _compatible(self, other):
+        # No posting lists to merge, so set operations go item by item
+        return False
+
+    # Search budgets apply to scanning posting lists, which NGramLSH has not
+    search = NGramAbstract.search
+    find = NGramAbstract.find
+
+    @staticmethod
+    def _gram_hash(ngram):
+        if isinstance(ngram, unicode):
+            ngram = ngram.encode('utf-8')
+        return zlib.crc32(ngram) & 0xffffffff
+
+    def signature(self, ngrams):
+        """MinHash signature of a collection of n-grams.
+
+        :return: list of ``bands * rows`` integers.
+        """
+        hashes = set(self._gram_hash(ngram) for ngram in ngrams)
+        if not hashes:
+            return []
+        return [min((a * x + b) % _PRIME for x in hashes)
+                for a, b in self._permutations]
+
+    def _keys(self, string):
+        """LSH bucket keys of the padded string."""
+        signature = self.signature(self.split(string))
+        if not signature:
+            return []
+        rows = self.rows
+        return [hash((band, tuple(signature[band * rows:(band + 1) * rows])))
+                for band in range(self.bands)]
+
+    def add(self, item):
+        """Add an item to the index (only if it has not already been added).
+
+        >>> n = NGramLSH()
+        >>> n.add("ham")
+        >>> n
+        NGramLSH(['ham'])
+        """
+        if item not in self:
+            set.add(self, item)
+            string = self.key(item)
+            self.length[item] = len(self.pad(string))
+            keys = self._keys(string)
+            self._band_keys[item] = keys
+            for band_key in keys:
+                self._buckets.setdefault(band_key, set()).add(item)
+
+    def remove(self, item):
+        """Remove an item from the index. Inverts the add operation.
+
+        >>> n = NGramLSH(['spam', 'eggs'])
+        >>> n.remove('spam')
+        >>> n
+        NGramLSH(['eggs'])
+        """
+        if item in self:
+            set.remove(self, item)
+            del self.length[item]
+            for band_key in self._band_keys.pop(item):
+                bucket = self._buckets[band_key]
+                bucket.discard(item)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def items_sharing_ngrams(self, query, stats=None):
+        """Retrieve items colliding with the query in an LSH band, with their
+        exact number of n-grams shared with the query.
+
+        :param query: look up items that share N-grams with this string.
+        :return: dictionary from matched string to the number of shared N-grams.
+
+        >>> n = NGramLSH(["ham","spam","eggs"], bands=50, rows=1)
+        >>> n.items_sharing_ngrams("mam")
+        {'ham': 2, 'spam': 2}
+        """
+        candidates = set()
+        for band_key in self._keys(query):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                candidates.update(bucket)
+                if stats is not None:
+                    stats['postings_scanned'] += len(bucket)
+        query_counts = self._counts(self.split(query))
+        if stats is not None:
+            stats['grams'] += sum(query_counts.itervalues())
+        shared = {}
+        for match in candidates:
+            counts = self._counts(self.splititem(match))
+            samegrams = sum(min(count, counts.get(ngram, 0))
+                            for ngram, count in query_counts.iteritems())
+            if samegrams:
+                shared[match] = samegrams
+        return shared
+
+    @staticmethod
+    def _counts(ngrams):
+        counts = {}
+        for ngram in ngrams:
+            counts[ngram] = counts.get(ngram, 0) + 1
+        return counts
@@ -0,0 +1,180 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+from ngram import NGram
+from ngram_abstract import SearchResults
+
+class PartitionedNGram(object):
+    """An index of items labelled with a partition, such as a tenant or a
+    category, whose searches can be restricted to some partitions.
+
+    Each partition has its own `NGram`, so that a search of a partition only
+    walks the posting lists of its items and costs in proportion to its
+    size rather than to the whole index.  The similarity of an item does not
+    depend on the other items, so searching several partitions gives the
+    same results as one NGram of all their items.  The exception is
+    `max_df`, which each partition applies to its own document frequencies,
+    so that an n-gram may be a stop-gram in some partitions but not others,
+    or in none although it would be in one NGram of all the items.
+
+    :param items: iteration of items to index.
+
+    :type partition: function(item) -> hashable label
+
+    :param partition: label of the partition of an item.  An item must keep\
+    its label for as long as it is in the index.
+
+    :param params: other keyword arguments for each `NGram`, such as\
+    `threshold`, `key` or `N`.
+
+    >>> n = PartitionedNGram(["ham", "spam", "eggs", "hamster"], partition=len)
+    >>> n.search("ham")
+    [('ham', 1.0), ('hamster', 0.2727272727272727), ('spam', 0.2222222222222222)]
+    >>> n.search("ham", partition=4)
+    [('spam', 0.2222222222222222)]
+    >>> n.search("ham", partition=[3, 7])
+    [('ham', 1.0), ('hamster', 0.2727272727272727)]
+    >>> sorted(n.labels())
+    [3, 4, 7]
+    """
+
+    def __init__(self, items=[], partition=None, **params):
+        if partition is None:
+            raise ValueError("Require a partition function")
+        self.partition = partition
+        self.params = params
+        self._parts = {}
+        self.update(items)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, sorted(self))
+
+    def __len__(self):
+        return sum(len(part) for part in self._parts.itervalues())
+
+    def __iter__(self):
+        for part in self._parts.itervalues():
+            for item in part:
+                yield item
+
+    def __contains__(self, item):
+        part = self._parts.get(self.partition(item))
+        return part is not None and item in part
+
+    def labels(self):
+        """Return the labels of the partitions with items."""
+        return self._parts.keys()
+
+    def part(self, label):
+        """Return the NGram of the items in a partition, or None if it has
+        no items.  It should not be modified directly."""
+        return self._parts.get(label)
+
+    def add(self, item):
+        """Add an item to the index of its partition."""
+        label = self.partition(item)
+        part = self._parts.get(label)
+        if part is None:
+            part = self._parts[label] = NGram(**self.params)
+        part.add(item)
+
+    def update(self, items):
+        """Add items to the index, grouped by partition."""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.partition(item), []).append(item)
+        for label, group in groups.iteritems():
+            part = self._parts.get(label)
+            if part is None:
+                self._parts[label] = NGram(group, **self.params)
+            else:
+                part.update(group)
+
+    def remove(self, item):
+        """Remove an item from the index, raising KeyError if it is absent."""
+        if item not in self:
+            raise KeyError(item)
+        self.discard(item)
+
+    def discard(self, item):
+        """Remove an item from the index if it is present."""
+        label = self.partition(item)
+        part = self._parts.get(label)
+        if part is not None:
+            part.discard(item)
+            if not part:
+                del self._parts[label]
+
+    def _select(self, partition):
+        """Return the NGrams of a label, of a list, set or frozenset of
+        labels, or of all partitions when None."""
+        if partition is None:
+            return self._parts.values()
+        if not isinstance(partition, (list, set, frozenset)):
+            partition = [partition]
+        return [self._parts[label] for label in partition
+                if label in self._parts]
+
+    def search(self, query, threshold=None, partition=None, **budget):
+        """Search the index, see `NGram.search`.
+
+        :param partition: label of the partition to search, or a list, set\
+        or frozenset of labels, or None to search every partition.
+
+        :param budget: `timeout` and `max_postings` of `NGram.search`, which\
+        apply to each partition searched.
+
+        :return: `SearchResults` of pairs of (item, similarity) by\
+        decreasing similarity.
+        """
+        results = SearchResults()
+        for part in self._select(partition):
+            found = part.search(query, threshold, **budget)
+            results.extend(found)
+            results.complete = results.complete and found.complete
+        results.sort(key=lambda x:x[1], reverse=True)
+        return results
+
+    def searchitem(self, item, threshold=None, partition=None):
+        """Search the index for items similar to `item`, see
+        `NGram.searchitem`."""
+        results = SearchResults()
+        for part in self._select(partition):
+            results.extend(part.searchitem(item, threshold))
+        results.sort(key=lambda x:x[1], reverse=True)
+        return results
+
+    def search_batch(self, queries, threshold=None, partition=None):
+        """Search the index for each of several query strings."""
+        return [self.search(query, threshold, partition) for query in queries]
+
+    def find(self, query, threshold=None, partition=None, **budget):
+        """Return the best match to the query, or None on no match."""
+        results = self.search(query, threshold, partition, **budget)
+        return results[0][0] if results else None
+
+    def finditem(self, item, threshold=None, partition=None):
+        """Return the most similar item to `item`, or None on no match."""
+        results = self.searchitem(item, threshold, partition)
+        return results[0][0] if results else None
@@ -22,9 +22,21 @@ Lesser General Public License for more details.
 See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
 """
 
-import redis
+import heapq
+import sys
+import time
+from collections import OrderedDict
+from itertools import islice
 
-from ngram_abstract import NGramAbstract
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from ngram_abstract import NGramAbstract, _summary
+
+# Keys read per round trip by `NGramRedis.stats`
+_STATS_BATCH = 1000
 
 class NGramRedis(NGramAbstract):
     """A set that supports lookup by NGram string similarity.
@@ -65,9 +77,28 @@ class NGramRedis(NGramAbstract):
 
     :param db: redis database to use
 
+    :param client: Redis client to use instead of connecting to `db` on the\
+    local host, such as a ``redis.Redis`` of another host.
+
     :param enable_auto_blacklist: allow to automatically blacklist the ngrams\
     present in more than 10% of the items
 
+    :type cache_size: int >= 0
+
+    :param cache_size: maximum number of n-gram posting lists to keep in the\
+    client-side cache (0 for no limit on the number of entries).
+
+    :type cache_bytes: int >= 0
+
+    :param cache_bytes: maximum estimated size in bytes of the cached posting\
+    lists (0 for no limit on the size).  The cache is disabled when both\
+    `cache_size` and `cache_bytes` are 0.
+
+    The cache is kept coherent with writers through a per-n-gram version\
+    counter stored in the ``gram_version`` hash, which is incremented by every\
+    `add` that touches the n-gram.  A query reads the versions of its n-grams\
+    in a single round trip and only fetches the posting lists that changed.
+
     Instance variables:
 
     :ivar _grams: For each n-gram, the items containing it and the number of times\
@@ -75,16 +106,34 @@ class NGramRedis(NGramAbstract):
 
     :ivar length: maps items to length of the padded string representations as
     ``{item:int, ...}``.
+
+    :ivar cache_stats: counters for the posting list cache as\
+    ``{'hits':int, 'misses':int, 'bytes_saved':int, 'evictions':int}``.
     """
 
     def __init__(self, items=[], threshold=0.0, warp=1.0, key=None,
                     N=3, pad_len=None, pad_char='$', db=0,
-                    enable_auto_blacklist=True):
+                    enable_auto_blacklist=True, cache_size=0, cache_bytes=0,
+                    client=None):
         super(NGramRedis, self).__init__(items, threshold , warp, key, N,
                 pad_len, pad_char)
-        self.r = redis.Redis(db=db)
+        if not cache_size >= 0:
+            raise ValueError("Require cache_size >= 0, not: " + str(cache_size))
+        if not cache_bytes >= 0:
+            raise ValueError("Require cache_bytes >= 0, not: " + str(cache_bytes))
+        if client is None:
+            if redis is None:
+                raise ImportError("NGramRedis requires the redis package")
+            client = redis.Redis(db=db)
+        self.r = client
         self.enable_auto_blacklist = enable_auto_blacklist
         self.blacklist = []
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        # ngram -> (version, [(match, count), ...], estimated bytes)
+        self._cache = OrderedDict()
+        self._cache_used = 0
+        self.cache_stats = dict(hits=0, misses=0, bytes_saved=0, evictions=0)
 
     def add(self, item, item_id):
         """Add an item to the N-gram index (only if it has not already been added).
@@ -116,15 +165,167 @@ class NGramRedis(NGramAbstract):
                 # Item present in > 10% of the items
                 if item_id > 100000 and zcards[i] > (int(item_id) / 10):
                     pipeline.delete(ngram)
+                    pipeline.hincrby("gram_version", ngram, 1)
                     self.blacklist.append(ngram)
                     continue
             # Add a new n-gram and string to index if necessary
             # Increment number of times the n-gram appears in the string
             pipeline.zincrby(ngram, item_id)
+            # Invalidate cached copies of the posting list held by readers
+            pipeline.hincrby("gram_version", ngram, 1)
         pipeline.execute()
 
+    @property
+    def cache_enabled(self):
+        return bool(self.cache_size or self.cache_bytes)
 
-    def items_sharing_ngrams(self, query):
+    def cache_info(self):
+        """Report the effectiveness of the posting list cache.
+
+        :return: dictionary of the `cache_stats` counters plus the current\
+        number of ``entries``, the estimated ``bytes`` held and the ``hit_rate``.
+        """
+        info = dict(self.cache_stats)
+        lookups = info['hits'] + info['misses']
+        info['hit_rate'] = info['hits'] / lookups if lookups else 0.0
+        info['entries'] = len(self._cache)
+        info['bytes'] = self._cache_used
+        return info
+
+    def clear_cache(self):
+        """Drop all cached posting lists and reset the cache counters."""
+        self._cache.clear()
+        self._cache_used = 0
+        self.cache_stats = dict(hits=0, misses=0, bytes_saved=0, evictions=0)
+
+    @staticmethod
+    def _postings_size(postings):
+        """Estimate the bytes held by a cached posting list."""
+        return sys.getsizeof(postings) + sum(
+            sys.getsizeof(match) + sys.getsizeof(count) for match, count in postings)
+
+    def _cache_store(self, ngram, version, postings):
+        size = self._postings_size(postings)
+        old = self._cache.pop(ngram, None)
+        if old is not None:
+            self._cache_used -= old[2]
+        self._cache[ngram] = (version, postings, size)
+        self._cache_used += size
+        # Evict least recently used posting lists beyond the bounds
+        while self._cache and (
+                (self.cache_size and len(self._cache) > self.cache_size) or
+                (self.cache_bytes and self._cache_used > self.cache_bytes)):
+            _, (_, _, evicted) = self._cache.popitem(last=False)
+            self._cache_used -= evicted
+            self.cache_stats['evictions'] += 1
+
+    # Keys of the index that are not n-gram posting lists
+    _META_KEYS = ('item_length', 'gram_version')
+
+    def _memory_usage(self, key):
+        """Bytes used by a key, or None before Redis 4.0."""
+        try:
+            return self.r.execute_command('MEMORY', 'USAGE', key)
+        except redis.ResponseError:
+            return None
+
+    def stats(self, top=10):
+        """Describe the size and shape of the index as stored in Redis, like
+        `NGram.stats`.
+
+        Every key of the database other than ``item_length`` and\
+        ``gram_version`` is taken to be the posting list of an n-gram.  Their\
+        sizes are read in pipelined batches of ``ZCARD`` and, from Redis 4.0,\
+        ``MEMORY USAGE`` commands.
+
+        :param top: number of heaviest n-grams to list.
+
+        :return: dictionary of the number of ``items``, ``grams`` and\
+        ``postings`` entries, the ``posting_lengths`` summary, the\
+        ``top_grams``, the number of ``stop_grams`` in the auto blacklist, the\
+        ``mean_padded_length`` of the items, and a ``memory`` dictionary of\
+        the bytes used by the ``postings`` sorted sets, the ``length`` and\
+        ``versions`` hashes and their ``total`` (None before Redis 4.0), and\
+        the ``used_memory`` of the whole server.
+        """
+        usage = self._memory_usage('item_length') is not None
+        sizes = []
+        heaviest = []
+        postings_memory = 0
+        keys = (key for key in self.r.scan_iter(count=_STATS_BATCH)
+                if key not in self._META_KEYS)
+        while True:
+            batch = list(islice(keys, _STATS_BATCH))
+            if not batch:
+                break
+            pipeline = self.r.pipeline(False)
+            for key in batch:
+                pipeline.zcard(key)
+                if usage:
+                    pipeline.execute_command('MEMORY', 'USAGE', key)
+            replies = pipeline.execute()
+            step = 2 if usage else 1
+            batch_sizes = replies[::step]
+            if usage:
+                postings_memory += sum(replies[1::2])
+            sizes.extend(batch_sizes)
+            heaviest = heapq.nsmallest(top, heaviest + zip(batch, batch_sizes),
+                                       key=lambda entry: (-entry[1], entry[0]))
+        memory = dict(used_memory=self.r.info('memory')['used_memory'],
+                      postings=None, length=None, versions=None, total=None)
+        if usage:
+            memory.update(postings=postings_memory,
+                          length=self._memory_usage('item_length') or 0,
+                          versions=self._memory_usage('gram_version') or 0)
+            memory['total'] = (memory['postings'] + memory['length'] +
+                               memory['versions'])
+        lengths = [int(length) for length in self.r.hvals('item_length')]
+        return dict(items=len(lengths), grams=len(sizes),
+                    postings=sum(sizes), posting_lengths=_summary(sizes),
+                    top_grams=heaviest, stop_grams=len(self.blacklist),
+                    mean_padded_length=_summary(lengths)['mean'],
+                    memory=memory)
+
+    def _postings(self, ngrams):
+        """Fetch the posting lists of the distinct n-grams.
+
+        :param ngrams: list of distinct n-grams.
+        :return: dictionary from n-gram to list of ``(match, count)`` pairs.
+        """
+        if not self.cache_enabled:
+            pipeline = self.r.pipeline(False)
+            for ngram in ngrams:
+                pipeline.zrange(ngram, 0, -1, withscores=True)
+            return dict(zip(ngrams, pipeline.execute()))
+        postings = {}
+        missing = []
+        versions = self.r.hmget("gram_version", ngrams) if ngrams else []
+        for ngram, version in zip(ngrams, versions):
+            cached = self._cache.pop(ngram, None)
+            if cached is not None and cached[0] == version:
+                # Re-insert to mark as most recently used
+                self._cache[ngram] = cached
+                postings[ngram] = cached[1]
+                self.cache_stats['hits'] += 1
+                self.cache_stats['bytes_saved'] += cached[2]
+            else:
+                if cached is not None:
+                    self._cache_used -= cached[2]
+                missing.append((ngram, version))
+                self.cache_stats['misses'] += 1
+        if missing:
+            pipeline = self.r.pipeline(False)
+            for ngram, version in missing:
+                pipeline.zrange(ngram, 0, -1, withscores=True)
+            # A write racing with the fetch bumps the version after the one
+            # we recorded, so the entry is refetched on the next lookup.
+            for (ngram, version), fetched in zip(missing, pipeline.execute()):
+                postings[ngram] = fetched
+                self._cache_store(ngram, version, fetched)
+        return postings
+
+
+    def items_sharing_ngrams(self, query, stats=None):
         """Retrieve the subset of items that share n-grams the query string.
 
         :param query: look up items that share N-grams with this string.
@@ -134,11 +335,21 @@ class NGramRedis(NGramAbstract):
         >>> n.items_sharing_ngrams("mam")
         {'ham': 2, 'spam': 2}
         """
-        # From matched string to number of N-grams shared with query string
         query = query.lower()
+        ngrams = list(self.split(query))
+        postings = self._postings(list(set(ngrams)))
+        if stats is not None:
+            stats['grams'] += len(ngrams)
+            stats['postings_scanned'] += sum(len(postings[n]) for n in ngrams)
+        return self._count_shared(ngrams, postings)
+
+    @staticmethod
+    def _count_shared(ngrams, postings):
+        """Count the query n-grams found in each item's posting lists."""
+        # From matched string to number of N-grams shared with query string
         shared = {}
-        for ngram in self.split(query):
-            for match, count in self.r.zrange(ngram, 0, -1, withscores=True):
+        for ngram in ngrams:
+            for match, count in postings[ngram]:
                 if shared.get(match) is None:
                     shared[match] = 1
                 else:
@@ -147,6 +358,57 @@ class NGramRedis(NGramAbstract):
                 #shared[match] += count
         return shared
 
+    def search(self, query, threshold=None):
+        """Search the index for items whose key exceeds threshold
+        similarity to the query string.
+
+        Uses `search_batch` so that a query costs a constant number of round
+        trips regardless of how many n-grams and candidates it has.
+        """
+        return self.search_batch([query], threshold)[0]
+
+    def search_batch(self, queries, threshold=None):
+        """Search the index for each of several query strings.
+
+        The distinct n-grams of all the queries are fetched once in a single
+        pipeline, the padded lengths of all candidates with one ``HMGET``, and
+        every query is then scored locally.
+
+        With a `search_hook`, the hook is called for each query, with the\
+        ``candidate_seconds`` of the whole batch.
+
+        :return: list with the result of `search` for each query.
+        """
+        start = time.time()
+        splits = [list(self.split(query.lower())) for query in queries]
+        distinct = list(set(ngram for ngrams in splits for ngram in ngrams))
+        postings = self._postings(distinct)
+        shared = [self._count_shared(ngrams, postings) for ngrams in splits]
+        candidates = list(set(match for s in shared for match in s))
+        lengths = {}
+        if candidates:
+            lengths = dict(zip(candidates, (int(l) for l in
+                                self.r.hmget("item_length", candidates))))
+        hook = self.search_hook
+        if hook is None:
+            return [self.rank_candidates(query, s, threshold, lengths)
+                    for query, s in zip(queries, shared)]
+        candidate_seconds = time.time() - start
+        batch = []
+        for query, ngrams, s in zip(queries, splits, shared):
+            middle = time.time()
+            results = self.rank_candidates(query, s, threshold, lengths)
+            score_seconds = time.time() - middle
+            stats = self._new_stats(query)
+            stats.update(grams=len(ngrams), postings_scanned=sum(
+                len(postings[n]) for n in ngrams), candidates=len(s),
+                scored=len(s), matched=len(results),
+                candidate_seconds=candidate_seconds,
+                score_seconds=score_seconds,
+                total_seconds=candidate_seconds + score_seconds)
+            hook(stats)
+            batch.append(results)
+        return batch
 
     def get_item_length(self, match):
         return int(self.r.hget("item_length", match))
@@ -0,0 +1,524 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import json
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import time
+from Queue import Queue, Empty
+
+from ngram_abstract import SearchResults
+
+# Index inherited by forked worker processes
+_index = None
+
+def answer(index, message):
+    """Answer one request message with a response message.
+
+    A request is a dictionary with the ``query`` string, the ``op`` of
+    ``search`` (the default) or ``find``, an ``id`` copied to the response,
+    optionally the ``threshold``, ``timeout`` and ``max_postings`` of
+    `NGram.search`, and a ``limit`` on the number of results.  The response
+    has ``results``, a list of [item, similarity] for ``search``, or
+    ``result``, the best item or None for ``find``, and ``complete``, false
+    when a budget cut the search short.  On failure it has ``error`` instead.
+
+    >>> from ngram import NGram
+    >>> n = NGram(["ham", "spam", "eggs"], N=2)
+    >>> sorted(answer(n, {'id': 1, 'query': 'ham'}).items())
+    [('complete', True), ('id', 1), ('results', [('ham', 1.0), ('spam', 0.2857142857142857)])]
+    >>> answer(n, {'id': 2, 'query': 'ham', 'limit': 1})['results']
+    [('ham', 1.0)]
+    >>> answer(n, {'id': 2, 'op': 'find', 'query': 'egg'})['result']
+    'eggs'
+    >>> answer(n, {'id': 3, 'op': 'delete', 'query': 'ham'})['error']
+    'Unknown op: delete'
+    """
+    try:
+        _check(message)
+        budget = dict((name, message[name])
+                      for name in ('timeout', 'max_postings')
+                      if message.get(name) is not None)
+        results = index.search(message['query'], message.get('threshold'),
+                               **budget)
+    except Exception, exc:
+        return {'id': message.get('id'), 'error': str(exc)}
+    return _response(message, results)
+
+def answer_batch(index, messages):
+    """Answer a batch of request messages, see `answer`.
+
+    Searches without a budget are grouped by threshold and answered by one
+    `search_batch` call per group.  This saves the per-call overhead, and
+    with `gram_ids` computes the n-gram ids of the group at once, but each
+    query still walks its own posting lists.
+
+    :return: list of the response to each message.
+    """
+    responses = [None] * len(messages)
+    groups = {}
+    for i, message in enumerate(messages):
+        threshold = message.get('threshold')
+        if (message.get('timeout') is None and
+            message.get('max_postings') is None and
+            isinstance(threshold, (int, long, float, type(None)))):
+            groups.setdefault(threshold, []).append(i)
+        else:
+            responses[i] = answer(index, message)
+    for threshold, positions in groups.iteritems():
+        try:
+            for i in positions:
+                _check(messages[i])
+            queries = [messages[i]['query'] for i in positions]
+            batch = index.search_batch(queries, threshold)
+        except Exception:
+            # Let each request fail or succeed on its own
+            for i in positions:
+                responses[i] = answer(index, messages[i])
+        else:
+            for i, results in zip(positions, batch):
+                responses[i] = _response(messages[i], results)
+    return responses
+
+def _check(message):
+    if message.get('op', 'search') not in ('search', 'find'):
+        raise ValueError("Unknown op: " + str(message.get('op')))
+    if not isinstance(message.get('query'), basestring):
+        raise ValueError("Require a query string, not: " +
+                         repr(message.get('query')))
+
+def _response(message, results):
+    response = {'id': message.get('id'),
+                'complete': getattr(results, 'complete', True)}
+    if message.get('op') == 'find':
+        response['result'] = results[0][0] if results else None
+    else:
+        response['results'] = list(results[:message.get('limit')])
+    return response
+
+def _errors(messages, exc):
+    """Return an error response to each message."""
+    return [{'id': message.get('id'), 'error': str(exc)}
+            for message in messages]
+
+def _answer_task(messages):
+    """Worker process entry point, answering a batch with the inherited index."""
+    try:
+        return answer_batch(_index, messages)
+    except Exception, exc:
+        return _errors(messages, exc)
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """Reads request lines from one connection and writes each response as
+    soon as it is ready, so that a client may pipeline requests and receive
+    the responses out of order."""
+
+    def handle(self):
+        lock = threading.Condition()
+        pending = [0]
+        def reply(response):
+            try:
+                line = json.dumps(response) + '\n'
+            except Exception, exc: # such as an item that is not JSON
+                line = json.dumps({'id': response.get('id'),
+                                   'error': str(exc)}) + '\n'
+            with lock:
+                try:
+                    self.wfile.write(line)
+                    self.wfile.flush()
+                except socket.error:
+                    pass # the client went away
+                finally:
+                    pending[0] -= 1
+                    lock.notify()
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            with lock:
+                pending[0] += 1
+            try:
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("Require a JSON object, not: " + line)
+            except ValueError, exc:
+                reply({'id': None, 'error': str(exc)})
+                continue
+            self.server.ngram_server.submit(message, reply)
+        with lock:
+            while pending[0]:
+                lock.wait()
+
+
+class _TCPServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class NGramServer(object):
+    """Serves searches of one index to many clients over TCP or a unix
+    socket, so that processes can share an index instead of each loading
+    its own.
+
+    The protocol is JSON lines: each request is a JSON object on a line,
+    answered by a JSON object on a line, see `answer` for their fields.
+    Responses on a connection follow the order in which they are ready, and
+    are matched to requests by ``id``.
+
+    Requests from all connections are queued and taken in micro-batches: a
+    batch takes the requests already queued, up to `max_batch`, waiting
+    `batch_window` seconds after its first request for more to arrive.
+    Each batch is answered by `answer_batch`, in a pool of worker processes
+    when `workers` is above one, so that reading and writing connections
+    never waits for a search.  While every worker is busy requests keep
+    queueing, so batches grow with the load.  A request that fails, even
+    while its response is sent back, gets an error response.
+
+    :param index: the index to serve, for example an `NGram` or a\
+    `FrozenNGram`.  It must not be modified while being served.
+
+    :param address: (host, port) to listen on over TCP, where port 0 picks\
+    a free port, or the path of a unix socket to create.
+
+    :type workers: int >= 1
+
+    :param workers: number of worker processes, which share the index by\
+    forking.  With one, batches are answered by a thread of the server.
+
+    :param batch_window: seconds to wait for more requests to join a batch.\
+    Waiting pays off only with more concurrent clients than `max_batch`.
+
+    :type max_batch: int >= 1
+
+    :param max_batch: maximum number of requests in a batch.
+
+    >>> from ngram import NGram
+    >>> server = NGramServer(NGram(["ham", "spam", "eggs"], N=2),
+    ...                      ('localhost', 0))
+    >>> server.start()
+    >>> client = NGramClient(server.address)
+    >>> client.search("ham")
+    [(u'ham', 1.0), (u'spam', 0.2857142857142857)]
+    >>> client.find("egg")
+    u'eggs'
+    >>> client.close()
+    >>> server.shutdown()
+    """
+
+    def __init__(self, index, address, workers=1, batch_window=0,
+                 max_batch=64):
+        if not workers >= 1:
+            raise ValueError("Require workers >= 1, not: " + str(workers))
+        if not max_batch >= 1:
+            raise ValueError("Require max_batch >= 1, not: " + str(max_batch))
+        self.index = index
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._pool = None
+        if workers > 1:
+            # Fork before any thread starts
+            global _index
+            from multiprocessing import Pool
+            _index = index
+            try:
+                self._pool = Pool(workers)
+            finally:
+                _index = None
+            # Batches in flight, so that waiting ones keep growing
+            self._slots = threading.Semaphore(2 * workers)
+            self._failures = Queue()
+            collector = threading.Thread(target=self._collect_loop)
+            collector.daemon = True
+            collector.start()
+        if isinstance(address, basestring):
+            self._server = _UnixServer(address, _Handler)
+        else:
+            self._server = _TCPServer(address, _Handler)
+        self._server.ngram_server = self
+        self._serving = False
+        self._batcher = threading.Thread(target=self._batch_loop)
+        self._batcher.daemon = True
+        self._batcher.start()
+
+    @property
+    def address(self):
+        """The address listened on, with the port chosen when it was 0."""
+        return self._server.server_address
+
+    def serve_forever(self):
+        """Serve requests until `shutdown` is called from another thread."""
+        self._serving = True
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve requests on a background thread until `shutdown`."""
+        self._serving = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def shutdown(self):
+        """Stop serving, and release the socket and the workers."""
+        if self._serving:
+            self._server.shutdown()
+        self._server.server_close()
+        self._queue.put(None)
+        self._batcher.join()
+        if self._pool is not None:
+            self._failures.put(None)
+            self._pool.terminate()
+        address = self.address
+        if isinstance(address, basestring) and os.path.exists(address):
+            os.unlink(address)
+
+    def submit(self, message, reply):
+        """Queue a request message, to be answered by calling `reply` with
+        the response message."""
+        self._queue.put((message, reply))
+
+    def _batch_loop(self):
+        queue = self._queue
+        while True:
+            entry = queue.get()
+            if entry is None:
+                return
+            if self._pool is not None:
+                self._slots.acquire()
+            batch = [entry]
+            deadline = time.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    entry = queue.get(True, max(deadline - time.time(), 0))
+                except Empty:
+                    break
+                if entry is None:
+                    queue.put(None) # stop after this batch
+                    break
+                batch.append(entry)
+            messages = [message for message, reply in batch]
+            replies = [reply for message, reply in batch]
+            if self._pool is None:
+                try:
+                    responses = answer_batch(self.index, messages)
+                except Exception, exc:
+                    responses = _errors(messages, exc)
+                self._deliver(replies, responses)
+                continue
+            try:
+                result = self._pool.apply_async(
+                    _answer_task, (messages,),
+                    callback=lambda responses, replies=replies:
+                        self._deliver(replies, responses))
+            except Exception, exc:
+                self._deliver(replies, _errors(messages, exc))
+            else:
+                self._failures.put((result, messages, replies))
+
+    def _collect_loop(self):
+        # The callback of a pool task only runs when it succeeds, so this
+        # answers the batches whose task failed, say to pickle its responses
+        while True:
+            entry = self._failures.get()
+            if entry is None:
+                return
+            result, messages, replies = entry
+            result.wait()
+            if not result.successful():
+                try:
+                    result.get()
+                except Exception, exc:
+                    self._deliver(replies, _errors(messages, exc))
+
+    def _deliver(self, replies, responses):
+        try:
+            for reply, response in zip(replies, responses):
+                try:
+                    reply(response)
+                except Exception:
+                    pass # never stop the other replies or the batches
+        finally:
+            if self._pool is not None:
+                self._slots.release()
+
+
+class NGramClient(object):
+    """Client of an `NGramServer`, with the search methods of an index.
+
+    Requests on one client are serialized, so use one client per thread,
+    or `search_batch` to send many requests at once.
+
+    :param address: (host, port) of a TCP server or the path of a unix socket.
+
+    :param timeout: seconds to wait for the server before raising\
+    `socket.timeout`, or None to wait forever.
+    """
+
+    def __init__(self, address, timeout=None):
+        self.address = address
+        if isinstance(address, basestring):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._file = self._socket.makefile('rb')
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def close(self):
+        """Close the connection to the server."""
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, messages):
+        """Send request messages all at once, see `answer`, and return the
+        response messages in the same order.  The ``id`` of the messages is
+        assigned by the client.
+
+        :raise ValueError: when the server answers a request with an error.
+        """
+        with self._lock:
+            ids = []
+            lines = []
+            for message in messages:
+                self._next_id += 1
+                ids.append(self._next_id)
+                lines.append(json.dumps(dict(message, id=self._next_id)))
+            self._socket.sendall(''.join(line + '\n' for line in lines))
+            responses = {}
+            while len(responses) < len(ids):
+                line = self._file.readline()
+                if not line:
+                    raise socket.error("Connection closed by the server")
+                response = json.loads(line)
+                responses[response['id']] = response
+        results = [responses[i] for i in ids]
+        for response in results:
+            if 'error' in response:
+                raise ValueError(response['error'])
+        return results
+
+    def _query(self, op, query, threshold, timeout, max_postings):
+        message = {'op': op, 'query': query}
+        for name, value in [('threshold', threshold), ('timeout', timeout),
+                            ('max_postings', max_postings)]:
+            if value is not None:
+                message[name] = value
+        return message
+
+    def search(self, query, threshold=None, timeout=None, max_postings=None):
+        """Search the served index, see `NGram.search`.
+
+        :return: `SearchResults` of pairs of (item, similarity) by\
+        decreasing similarity.
+        """
+        response, = self.request([self._query('search', query, threshold,
+                                              timeout, max_postings)])
+        return _results(response)
+
+    def find(self, query, threshold=None, timeout=None, max_postings=None):
+        """Return the best match to the query, or None on no match."""
+        response, = self.request([self._query('find', query, threshold,
+                                              timeout, max_postings)])
+        return response['result']
+
+    def search_batch(self, queries, threshold=None):
+        """Search the served index for each of several query strings,
+        sending them all at once.
+
+        :return: list with the result of `search` for each query.
+        """
+        return [_results(response) for response in self.request(
+            [self._query('search', query, threshold, None, None)
+             for query in queries])]
+
+def _results(response):
+    return SearchResults([tuple(pair) for pair in response['results']],
+                         complete=response['complete'])
+
+
+def main():
+    """Serve an index from the command line."""
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Serve searches of an NGram index "
+                            "as JSON lines over TCP or a unix socket.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--items', metavar='PATH',
+                        help='Index the lines of a UTF-8 text file')
+    source.add_argument('--index', metavar='PATH',
+                        help='Load an index written by NGram.dump')
+    parser.add_argument('--threshold', type=float, default=0.0,
+                        help='Default threshold of an indexed --items file: '
+                        '%(default)s')
+    parser.add_argument('--host', default='localhost',
+                        help='Host to listen on: %(default)s')
+    parser.add_argument('--port', type=int, default=8437,
+                        help='TCP port to listen on: %(default)s')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='Listen on a unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes: %(default)s')
+    parser.add_argument('--batch-window', type=float, default=0,
+                        help='Seconds to gather a batch: %(default)s')
+    parser.add_argument('--max-batch', type=int, default=64,
+                        help='Maximum requests per batch: %(default)s')
+    args = parser.parse_args()
+    from ngram import NGram
+    if args.index:
+        with open(args.index, 'rb') as f:
+            index = NGram.load(f)
+    else:
+        with open(args.items) as f:
+            index = NGram((line.rstrip('\r\n').decode('utf-8') for line in f),
+                          threshold=args.threshold)
+    address = args.unix or (args.host, args.port)
+    server = NGramServer(index, address, args.workers, args.batch_window,
+                         args.max_batch)
+    print >>sys.stderr, "Serving %d items on %s" % (len(index), server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import threading
+import time
+import zlib
+from collections import deque
+
+from ngram import NGram
+from ngram_abstract import SearchResults, _summary
+from ngram_server import NGramClient, NGramServer
+
+# Latencies kept per shard for `ShardedNGram.stats`
+_LATENCY_WINDOW = 10000
+# Seconds for a spawned shard to index its items and start serving
+_START_TIMEOUT = 600
+
+def shard_of(item, shards, key=None):
+    """Return the shard of an item, from a hash of its key that is the same
+    in every process and on every host.
+
+    >>> shard_of('spam', 4), shard_of(u'spam', 4)
+    (1, 1)
+    """
+    string = key(item) if key is not None else item
+    if isinstance(string, unicode):
+        string = string.encode('utf-8')
+    return (zlib.crc32(string) & 0xffffffff) % shards
+
+def _serve_shard(items, params, connection):
+    """Shard process entry point, serving an NGram of the positions of its
+    items, keyed by their strings.  Sends back the address served, or the
+    error that stopped it starting."""
+    key = params.get('key')
+    if key is None:
+        params = dict(params, key=lambda i: items[i])
+    else:
+        params = dict(params, key=lambda i: key(items[i]))
+    try:
+        server = NGramServer(NGram(xrange(len(items)), **params),
+                             ('localhost', 0))
+    except Exception, exc:
+        connection.send((None, "%s: %s" % (type(exc).__name__, exc)))
+        return
+    connection.send((server.address, None))
+    connection.close()
+    server.serve_forever()
+
+
+class _Shard(object):
+    """Connection to one shard, with its request counters and latencies."""
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.timeout = timeout
+        self.client = None
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    def request(self, messages):
+        """Send request messages to the shard, reconnecting if needed.
+
+        :raise EnvironmentError: when the shard cannot be reached or does\
+        not answer within the timeout.
+        """
+        with self.lock:
+            self.requests += 1
+            start = time.time()
+            try:
+                if self.client is None:
+                    self.client = NGramClient(self.address, self.timeout)
+                return self.client.request(messages)
+            except EnvironmentError:
+                self.failures += 1
+                self.close() # a late answer would be read by the next request
+                raise
+            finally:
+                self.latencies.append(time.time() - start)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+class ShardedNGram(object):
+    """Searches an index split across shards, each an `NGramServer` in its
+    own process, possibly on another host.
+
+    A search is sent to every shard at once, and the results of the shards
+    are merged by similarity.  The similarity of an item does not depend on
+    the other items, so this gives the same results as searching one NGram
+    of all the items.  A shard that cannot be reached, or does not answer
+    within `timeout`, is left out of the results, which then have
+    ``complete`` False, and is reconnected to on the next search.  The
+    search fails only when every shard does.
+
+    Items cross from the shards as JSON, so with `addresses` they should be
+    strings, and come back as `unicode`.  The shards started by `spawn` send
+    back the positions of their items instead, so that any item comes back
+    as it was given.
+
+    :param addresses: addresses of the `NGramServer` of each shard, as\
+    (host, port) or the path of a unix socket.
+
+    :param timeout: seconds to wait for a shard to answer, or None to wait\
+    forever.
+
+    >>> n = ShardedNGram.spawn(["ham", "spam", "eggs"], 2, N=2)
+    >>> n.search("ham")
+    [('ham', 1.0), ('spam', 0.2857142857142857)]
+    >>> n.find("egg")
+    'eggs'
+    >>> n.close()
+    """
+
+    def __init__(self, addresses, timeout=None):
+        from multiprocessing.pool import ThreadPool
+        self.timeout = timeout
+        self._shards = [_Shard(address, timeout) for address in addresses]
+        self._pool = ThreadPool(len(self._shards))
+        self._processes = []
+        # Items of each shard by position, for the shards started by spawn
+        self._parts = None
+
+    @classmethod
+    def spawn(cls, items, shards, timeout=None, **params):
+        """Start a local process serving each shard of the items, and
+        return a ShardedNGram searching them.  The processes stop on
+        `close` or when this process exits.
+
+        :type shards: int >= 1
+
+        :param shards: number of shard processes.
+
+        :param params: other keyword arguments of the `NGram` of each\
+        shard, such as `threshold`, `key` or `N`.
+
+        :raise RuntimeError: when a shard fails to start, after stopping the\
+        shards already started.
+        """
+        from multiprocessing import Pipe, Process
+        if not shards >= 1:
+            raise ValueError("Require shards >= 1, not: " + str(shards))
+        parts = [[] for i in xrange(shards)]
+        for item in items:
+            parts[shard_of(item, shards, params.get('key'))].append(item)
+        processes = []
+        addresses = []
+        try:
+            for part in parts:
+                receiver, sender = Pipe(False)
+                process = Process(target=_serve_shard,
+                                  args=(part, params, sender))
+                process.daemon = True
+                process.start()
+                processes.append(process)
+                # Only the shard holds the sender, so its exit is seen as EOF
+                sender.close()
+                try:
+                    if not receiver.poll(_START_TIMEOUT):
+                        raise EOFError("timed out")
+                    address, error = receiver.recv()
+                except EOFError, exc:
+                    address, error = None, str(exc) or "exited"
+                finally:
+                    receiver.close()
+                if address is None:
+                    raise RuntimeError("Shard %d of %d failed to start: %s" %
+                                       (len(processes), shards, error))
+                addresses.append(address)
+        except BaseException:
+            for process in processes:
+                process.terminate()
+                process.join()
+            raise
+        result = cls(addresses, timeout)
+        result._processes = processes
+        result._parts = parts
+        return result
+
+    def close(self):
+        """Close the connections to the shards, and stop any shard
+        processes started by `spawn`."""
+        self._pool.terminate()
+        for shard in self._shards:
+            shard.close()
+        for process in self._processes:
+            process.terminate()
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def addresses(self):
+        """Addresses of the shards."""
+        return [shard.address for shard in self._shards]
+
+    def _scatter(self, messages):
+        """Send request messages to every shard at once.
+
+        :return: list of the responses of each shard, or None for a shard\
+        that failed.
+
+        :raise EnvironmentError: when every shard failed.
+        """
+        pending = [self._pool.apply_async(shard.request, (messages,))
+                   for shard in self._shards]
+        replies = []
+        error = None
+        for result in pending:
+            try:
+                replies.append(result.get())
+            except EnvironmentError, error:
+                replies.append(None)
+        if error is not None and not any(replies):
+            raise error
+        return replies
+
+    def search_batch(self, queries, threshold=None, limit=None, **budget):
+        """Search the shards for each of several query strings, sending
+        them all at once.
+
+        :param limit: maximum number of results per query, so that each\
+        shard only sends its best ones.
+
+        :param budget: `timeout` and `max_postings` of `NGram.search`, which\
+        apply to each shard.
+
+        :return: list of `SearchResults` for each query, by decreasing\
+        similarity.
+        """
+        messages = [dict(budget, query=query, threshold=threshold, limit=limit)
+                    for query in queries]
+        replies = self._scatter(messages)
+        batch = []
+        for i in xrange(len(messages)):
+            results = SearchResults()
+            for shard, responses in enumerate(replies):
+                if responses is None:
+                    results.complete = False
+                    continue
+                response = responses[i]
+                if self._parts is None:
+                    results.extend(tuple(pair) for pair in response['results'])
+                else:
+                    part = self._parts[shard]
+                    results.extend((part[position], similarity)
+                                   for position, similarity
+                                   in response['results'])
+                results.complete = results.complete and response['complete']
+            results.sort(key=lambda x:x[1], reverse=True)
+            if limit is not None:
+                del results[limit:]
+            batch.append(results)
+        return batch
+
+    def search(self, query, threshold=None, limit=None, **budget):
+        """Search the shards, see `NGram.search` and `search_batch`."""
+        return self.search_batch([query], threshold, limit, **budget)[0]
+
+    def find(self, query, threshold=None, **budget):
+        """Return the best match to the query, or None on no match."""
+        results = self.search(query, threshold, 1, **budget)
+        return results[0][0] if results else None
+
+    def stats(self):
+        """Return the counters of each shard.
+
+        :return: list with a dictionary for each shard of its ``address``,\
+        the number of ``requests`` and ``failures``, whether it is\
+        ``connected``, and the ``latency`` in seconds of its recent requests\
+        as the ``min``, ``median``, ``p99``, ``max`` and ``mean``.
+        """
+        return [dict(address=shard.address, requests=shard.requests,
+                     failures=shard.failures,
+                     connected=shard.client is not None,
+                     latency=_summary(list(shard.latencies)))
+                for shard in self._shards]
@@ -0,0 +1,277 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import cPickle as pickle
+import sqlite3
+from itertools import islice
+
+from ngram_abstract import NGramAbstract
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    item BLOB NOT NULL UNIQUE,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS grams (
+    id INTEGER PRIMARY KEY,
+    gram BLOB NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS postings (
+    gram_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (gram_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS postings_item ON postings (item_id);
+"""
+
+class NGramSQLite(NGramAbstract):
+    """A set that supports lookup by NGram string similarity, stored in an
+    SQLite database so that indexes larger than memory can be searched.
+
+    Accepts `unicode` string or an encoded `str` of bytes. With encoded `str` the
+    splitting is on byte boundaries, which will be incorrect if the encoding uses
+    multiple bytes per character.  You must provide NGram with unicode strings if
+    the encoding would have multi-byte characters.
+
+    Items are stored pickled, so they must pickle to the same bytes whenever
+    they are equal, as strings, numbers and tuples of those do.
+
+    :type threshold: float in 0.0 ... 1.0
+
+    :param threshold: minimum similarity for a string to be considered a match.
+
+    :type warp: float in 1.0 ... 3.0
+
+    :param warp: use warp greater than 1.0 to increase the similarity of shorter string pairs.
+
+    :type items: [item, ...]
+
+    :param items: iteration of items to index for N-gram search.
+
+    :type N: int >= 2
+
+    :param N: number of characters per n-gram.
+
+    :type pad_len: int in 0 ... N-1
+
+    :param pad_len: how many characters padding to add (defaults to N-1).
+
+    :type pad_char: str or unicode
+
+    :param pad_char: character to use for padding.  Default is '$', but consider using the\
+    non-breaking space character, ``u'\\xa0'`` (``u"\\u00A0"``).
+
+    :type key: function(item) -> str/unicode
+
+    :param key: Function to convert items into string, default is no conversion.
+
+    :param path: database file, by default a private in-memory database.\
+    An existing database is reopened, and must have been built with the same\
+    `N`, padding and key function.
+
+    :type batch_size: int >= 1
+
+    :param batch_size: number of items inserted per transaction by `update`.
+
+    Instance variables:
+
+    :ivar conn: the `sqlite3` connection holding the ``items``, ``grams`` and\
+    ``postings`` tables.
+    """
+
+    def __init__(self, items=[], threshold=0.0, warp=1.0, key=None,
+                    N=3, pad_len=None, pad_char='$', path=':memory:',
+                    batch_size=10000):
+        if not batch_size >= 1:
+            raise ValueError("Require batch_size >= 1, not: " + str(batch_size))
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.text_factory = str
+        if path != ':memory:':
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("CREATE TEMP TABLE query_grams "
+                          "(gram BLOB PRIMARY KEY, count INTEGER NOT NULL)")
+        super(NGramSQLite, self).__init__(items, threshold, warp, key, N,
+                pad_len, pad_char)
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+    @staticmethod
+    def _dumps(item):
+        return sqlite3.Binary(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _gram_blob(ngram):
+        """Encode an n-gram so that equal str and unicode n-grams match."""
+        if isinstance(ngram, unicode):
+            ngram = ngram.encode('utf-8')
+        return sqlite3.Binary(ngram)
+
+    def _gram_counts(self, string):
+        """Return the padded length and ``{ngram blob: count}`` of a string."""
+        padded = self.pad(string)
+        counts = {}
+        for ngram in self._split(padded):
+            counts[ngram] = counts.get(ngram, 0) + 1
+        return len(padded), [(self._gram_blob(ngram), count)
+                             for ngram, count in counts.iteritems()]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def __contains__(self, item):
+        return self.conn.execute("SELECT 1 FROM items WHERE item = ?",
+                                 (self._dumps(item),)).fetchone() is not None
+
+    def __iter__(self):
+        for (blob,) in self.conn.execute("SELECT item FROM items ORDER BY id"):
+            yield pickle.loads(str(blob))
+
+    def add(self, item):
+        """Add an item to the N-gram index (only if it has not already been added).
+
+        >>> n = NGramSQLite()
+        >>> n.add("ham")
+        >>> n.add("ham")
+        >>> len(n)
+        1
+        """
+        self.update([item])
+
+    def update(self, items):
+        """Add items to the index, inserting `batch_size` items per transaction.
+
+        >>> n = NGramSQLite(["spam"])
+        >>> n.update(["eggs", "ham"])
+        >>> sorted(n)
+        ['eggs', 'ham', 'spam']
+        """
+        items = iter(items)
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if not batch:
+                return
+            with self.conn:
+                cursor = self.conn.cursor()
+                grams = set()
+                postings = []
+                for item in batch:
+                    length, counts = self._gram_counts(self.key(item))
+                    cursor.execute("INSERT OR IGNORE INTO items (item, length) "
+                                   "VALUES (?, ?)", (self._dumps(item), length))
+                    if cursor.rowcount != 1:
+                        continue # already indexed
+                    item_id = cursor.lastrowid
+                    for gram, count in counts:
+                        grams.add(gram)
+                        postings.append((item_id, count, gram))
+                cursor.executemany("INSERT OR IGNORE INTO grams (gram) "
+                                   "VALUES (?)", ((g,) for g in grams))
+                cursor.executemany(
+                    "INSERT INTO postings (gram_id, item_id, count) "
+                    "SELECT id, ?, ? FROM grams WHERE gram = ?", postings)
+
+    def remove(self, item):
+        """Remove an item from the index. Inverts the add operation.
+
+        >>> n = NGramSQLite(['spam', 'eggs'])
+        >>> n.remove('spam')
+        >>> list(n)
+        ['eggs']
+        """
+        with self.conn:
+            row = self.conn.execute("SELECT id FROM items WHERE item = ?",
+                                    (self._dumps(item),)).fetchone()
+            if row is not None:
+                self.conn.execute("DELETE FROM postings WHERE item_id = ?", row)
+                self.conn.execute("DELETE FROM items WHERE id = ?", row)
+
+    def discard(self, item):
+        """If `item` is a member of the set, remove it."""
+        self.remove(item)
+
+    def _shared(self, query, stats=None):
+        """Aggregate in SQL the n-grams shared by the query and each item.
+
+        :return: dictionaries from item to number of shared n-grams and from\
+        item to padded length.
+        """
+        _, counts = self._gram_counts(query)
+        with self.conn:
+            self.conn.execute("DELETE FROM query_grams")
+            self.conn.executemany("INSERT INTO query_grams (gram, count) "
+                                  "VALUES (?, ?)", counts)
+            rows = self.conn.execute(
+                "SELECT i.item, i.length, SUM(MIN(p.count, q.count)), COUNT(*) "
+                "FROM query_grams q "
+                "JOIN grams g ON g.gram = q.gram "
+                "JOIN postings p ON p.gram_id = g.id "
+                "JOIN items i ON i.id = p.item_id "
+                "GROUP BY p.item_id").fetchall()
+        shared = {}
+        lengths = {}
+        for blob, length, samegrams, scanned in rows:
+            item = pickle.loads(str(blob))
+            shared[item] = samegrams
+            lengths[item] = length
+        if stats is not None:
+            stats['grams'] += sum(count for _, count in counts)
+            stats['postings_scanned'] += sum(row[3] for row in rows)
+        return shared, lengths
+
+    def items_sharing_ngrams(self, query, stats=None):
+        """Retrieve the subset of items that share n-grams the query string.
+
+        :param query: look up items that share N-grams with this string.
+        :return: dictionary from matched string to the number of shared N-grams.
+
+        >>> n = NGramSQLite(["ham","spam","eggs"])
+        >>> sorted(n.items_sharing_ngrams("mam").items())
+        [('ham', 2), ('spam', 2)]
+        """
+        return self._shared(query, stats)[0]
+
+    def get_item_length(self, match):
+        return self.conn.execute("SELECT length FROM items WHERE item = ?",
+                                 (self._dumps(match),)).fetchone()[0]
+
+    def search(self, query, threshold=None):
+        """Search the index for items whose key exceeds threshold
+        similarity to the query string.
+
+        >>> n = NGramSQLite([(0, "SPAM"), (1, "SPAN"), (2, "EG")], key=lambda x:x[1])
+        >>> sorted(n.search("SPA"))
+        [((0, 'SPAM'), 0.375), ((1, 'SPAN'), 0.375)]
+        """
+        if self.search_hook is not None:
+            return super(NGramSQLite, self).search(query, threshold)
+        shared, lengths = self._shared(query)
+        return self.rank_candidates(query, shared, threshold, lengths)
@@ -0,0 +1,125 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+Vectorized computation of integer n-gram ids for batches of strings, used by
+`NGram` with `gram_ids` for bulk indexing and batch search.  Uses NumPy when
+it is installed, and otherwise falls back to computing the same ids one
+string at a time in pure Python.
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ngram_abstract import _HASH_BASE, _HASH_PRIME
+
+
+def batch_gram_ids(index, padded, vectorize=True, query=False):
+    """Compute the n-gram ids of several padded strings at once.
+
+    :param index: `NGram` whose `N` and `gram_ids` mode define the ids.
+
+    :param padded: list of padded strings.
+
+    :param vectorize: use NumPy if it is installed.  The result is the same\
+    either way.
+
+    :param query: whether the strings are queries, see ``index._gram_ids``.
+
+    :return: list with the list of n-gram ids of each string, as produced by\
+    ``index._gram_ids``.
+
+    >>> from ngram import NGram
+    >>> index = NGram(gram_ids='packed', N=2)
+    >>> batch_gram_ids(index, ['abc', 'b']) == [
+    ...     [(ord('a') << 32) | ord('b'), (ord('b') << 32) | ord('c')], []]
+    True
+    >>> index = NGram(gram_ids='hashed')
+    >>> strings = [u'$$ham$$', u'$$\\xe9ggs$$', u'']
+    >>> (batch_gram_ids(index, strings) ==
+    ...  batch_gram_ids(index, strings, vectorize=False))
+    True
+    """
+    if vectorize and numpy is not None and index.gram_ids is not None:
+        codes = _code_points(padded)
+        if codes is not None:
+            return _vector_ids(index, padded, codes, query)
+    return [list(index._gram_ids(string, query)) for string in padded]
+
+
+def _code_points(strings):
+    """Concatenated code points of the strings as a uint64 array, or None
+    when the strings mix `str` and `unicode`."""
+    if all(isinstance(s, unicode) for s in strings):
+        data = numpy.frombuffer(u''.join(strings).encode('utf-32-le'),
+                                dtype='<u4')
+    elif all(isinstance(s, str) for s in strings):
+        data = numpy.frombuffer(''.join(strings), dtype=numpy.uint8)
+    else:
+        return None
+    return data.astype(numpy.uint64)
+
+def _mulmod(values, factor, prime):
+    """``values * factor % prime`` for values below the Mersenne prime
+    ``2**61 - 1`` and a factor below ``2**29``, without overflowing uint64."""
+    high = (values >> numpy.uint64(32)) * factor
+    low = (values & numpy.uint64(0xffffffff)) * factor
+    # high * 2**32 == (high << 32 mod 2**61) + (high >> 29) * 2**61
+    total = (((high << numpy.uint64(32)) & prime) +
+             (high >> numpy.uint64(29)) + low)
+    return _reduce(total, prime)
+
+def _reduce(values, prime):
+    """Reduce values below ``2**63`` modulo the Mersenne prime."""
+    values = (values & prime) + (values >> numpy.uint64(61))
+    return numpy.where(values >= prime, values - prime, values)
+
+def _vector_ids(index, padded, codes, query):
+    N = index.N
+    count = max(len(codes) - N + 1, 0)
+    # Id of the n-gram starting at every position of the concatenation
+    if index.gram_ids == 'packed':
+        bits = 64 // N
+        if len(codes) and int(codes.max()) >= (1 << bits):
+            # Raise the same error, or give the same ids, as the pure Python
+            # computation
+            return [list(index._gram_ids(string, query)) for string in padded]
+        ids = codes[:count]
+        for k in range(1, N):
+            ids = (ids << numpy.uint64(bits)) | codes[k:k + count]
+    else:
+        prime = numpy.uint64(_HASH_PRIME)
+        base = numpy.uint64(_HASH_BASE)
+        ids = numpy.zeros(count, dtype=numpy.uint64)
+        for k in range(N):
+            ids = _reduce(_mulmod(ids, base, prime) + codes[k:k + count],
+                          prime)
+    # Keep only n-grams lying within a single string
+    result = []
+    start = 0
+    for length in (len(s) for s in padded):
+        grams = max(length - N + 1, 0)
+        result.append(ids[start:start + grams].tolist())
+        start += length
+    return result
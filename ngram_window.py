@@ -0,0 +1,277 @@
+"""
+:mod:`ngram` -- Provides a set that supports lookup by string similarity
+========================================================================
+
+.. moduleauthor:: Graham Poulter (version 3.0+)
+.. moduleauthor:: Michel Albert (version 2.0.0b2)
+"""
+
+from __future__ import division
+
+__license__ = """
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+See LICENSE file or http://www.gnu.org/licenses/lgpl-2.1.html
+"""
+
+import time
+from collections import deque
+
+from ngram import NGram
+
+class NGramWindow(NGram):
+    """An NGram over a sliding window of recently added items, which expire
+    once they are older than `ttl` or when there are more than `max_items`.
+
+    Every item carries the timestamp of when it was added, and re-adding an
+    item refreshes it.  Items are kept in a queue by timestamp, so expiring
+    an item costs about as much as adding it, and the posting list entries
+    of expired items are removed along with posting lists left empty.
+    Timestamps should not decrease from one addition to the next.
+
+    :type ttl: number > 0 or None
+
+    :param ttl: items expire once their timestamp is `ttl` or more before the\
+    current time.  None for no time limit.
+
+    :type max_items: int >= 1 or None
+
+    :param max_items: the oldest items expire when the index would hold more\
+    than this many.  None for no size limit.
+
+    :type clock: function() -> number, or None
+
+    :param clock: current time, checked on every addition and search.  By\
+    default `time.time`, so that timestamps are in seconds.  When None, the\
+    timestamp of an item is its sequence number of addition, `ttl` counts\
+    additions, and items expire only as later items are added.
+
+    Other parameters are as for `NGram`, where a fractional `max_df` is of\
+    the items in the window.
+
+    >>> n = NGramWindow(ttl=2, clock=None)
+    >>> n.update(['spam', 'eggs'])
+    >>> n.add('ham')
+    >>> n
+    NGramWindow(['eggs', 'ham'])
+    >>> n.add('sham', timestamp=10)
+    >>> n
+    NGramWindow(['sham'])
+    """
+
+    def __init__(self, items=[], threshold=0.0, warp=1.0, key=None,
+                    N=3, pad_len=None, pad_char='$', gram_ids=None, ttl=None,
+                    max_items=None, clock=time.time, max_df=None):
+        if ttl is not None and not ttl > 0:
+            raise ValueError("Require ttl > 0, not: " + str(ttl))
+        if max_items is not None and not max_items >= 1:
+            raise ValueError("Require max_items >= 1, not: " + str(max_items))
+        self.ttl = ttl
+        self.max_items = max_items
+        self.clock = clock
+        # (timestamp, item) by addition, with stale entries for items that
+        # have since been refreshed or removed, and the live timestamps
+        self._order = deque()
+        self._times = {}
+        self._latest = 0
+        # Removals from each posting list since it was last compacted
+        self._removed = {}
+        NGram.__init__(self, items, threshold, warp, key, N, pad_len, pad_char,
+                       gram_ids, max_df)
+
+    def __reduce__(self):
+        """Return state information for pickling, keeping the timestamps.
+
+        >>> import pickle
+        >>> n = NGramWindow(['spam', 'eggs'], max_items=5, clock=None, max_df=3)
+        >>> m = pickle.loads(pickle.dumps(n))
+        >>> m.max_items, m.max_df, m.timestamp('eggs')
+        (5, 3, 2)
+        """
+        return NGramWindow, ([], self.threshold, self.warp, self._key, self.N,
+                             self._pad_len, self._pad_char, self.gram_ids,
+                             self.ttl, self.max_items, self.clock,
+                             self.max_df), \
+            list(self._live())
+
+    def __setstate__(self, stamps):
+        for timestamp, item in stamps:
+            self.add(item, timestamp)
+
+    def copy(self):
+        """Return a shallow copy of the NGramWindow object, with the same
+        timestamps."""
+        result = NGramWindow([], self.threshold, self.warp, self._key, self.N,
+                             self._pad_len, self._pad_char, self.gram_ids,
+                             self.ttl, self.max_items, self.clock, self.max_df)
+        result.__setstate__(self._live())
+        return result
+
+    def dump(self, f, protocol=None):
+        """Refuse to dump, as a dump has no timestamps.  Pickle the
+        NGramWindow instead.
+
+        >>> NGramWindow(['spam']).dump(None)
+        Traceback (most recent call last):
+        ...
+        TypeError: NGramWindow is saved by pickling
+        """
+        raise TypeError("NGramWindow is saved by pickling")
+
+    @classmethod
+    def load(cls, f):
+        # A dump has no timestamps to expire the items by
+        raise TypeError("NGramWindow is loaded by unpickling")
+
+    def _compatible(self, other):
+        # Merged posting lists would carry no timestamps
+        return False
+
+    def _live(self):
+        """Iterate over (timestamp, item) of the items, oldest first."""
+        times = self._times
+        for timestamp, item in self._order:
+            if times.get(item, self) == timestamp:
+                yield timestamp, item
+
+    def timestamp(self, item):
+        """Return the timestamp of an item in the index."""
+        return self._times[item]
+
+    def _stamp(self, item, timestamp=None):
+        if timestamp is None:
+            timestamp = (self.clock() if self.clock is not None
+                         else self._latest + 1)
+        self._latest = timestamp
+        self._times[item] = timestamp
+        self._order.append((timestamp, item))
+        # Drop stale entries once they are the majority, amortized O(1)
+        if len(self._order) > 2 * len(self._times) + 16:
+            seen = set()
+            order = deque()
+            for entry in self._live():
+                if entry[1] not in seen:
+                    seen.add(entry[1])
+                    order.append(entry)
+            self._order = order
+        return timestamp
+
+    def add(self, item, timestamp=None):
+        """Add an item to the index with a timestamp, by default the current
+        time, and expire items if needed.  Re-adding an item refreshes its
+        timestamp.
+
+        >>> n = NGramWindow(max_items=2)
+        >>> n.add("ham")
+        >>> n.add("spam")
+        >>> n.add("ham")
+        >>> n.add("eggs")
+        >>> n
+        NGramWindow(['eggs', 'ham'])
+        """
+        if item not in self:
+            NGram.add(self, item)
+        self.expire(self._stamp(item, timestamp))
+
+    def update(self, items, timestamp=None):
+        """Add items to the index, all with the same timestamp when one is
+        given, and expire items if needed.
+
+        >>> n = NGramWindow(["spam"], ttl=60)
+        >>> n.update(["eggs"])
+        >>> n
+        NGramWindow(['eggs', 'spam'])
+        """
+        if self.gram_ids is None:
+            for item in items:
+                self.add(item, timestamp)
+            return
+        items = list(items)
+        NGram.update(self, items)
+        for item in items:
+            self._stamp(item, timestamp)
+        self.expire(timestamp)
+
+    def remove(self, item):
+        """Remove an item from the index, deleting posting lists left empty
+        and compacting those that have shrunk by half.
+
+        >>> n = NGramWindow(['spam', 'eggs'])
+        >>> n.remove('spam')
+        >>> n, sorted(n._grams)
+        (NGramWindow(['eggs']), ['$$e', '$eg', 'egg', 'ggs', 'gs$', 's$$'])
+        """
+        if item not in self:
+            return
+        set.remove(self, item)
+        del self.length[item]
+        del self._times[item]
+        grams = self._grams
+        removed = self._removed
+        for ngram in set(self._gram_ids(self.pad(self.key(item)))):
+            posting = grams.get(ngram)
+            if posting is None or posting.pop(item, None) is None:
+                continue
+            if not posting:
+                del grams[ngram]
+                removed.pop(ngram, None)
+                continue
+            count = removed.get(ngram, 0) + 1
+            if count > len(posting):
+                # Dictionaries never shrink on deletion, so copy it
+                grams[ngram] = dict(posting)
+                del removed[ngram]
+            else:
+                removed[ngram] = count
+
+    def expire(self, now=None):
+        """Remove items older than `ttl` and the oldest items beyond
+        `max_items`.  Called on every addition and search, so it only needs
+        calling directly to release memory while the index is idle.
+
+        :param now: current time, by default from `clock`, or the latest\
+        sequence number without a clock.
+
+        :return: the number of items expired.
+
+        >>> n = NGramWindow(['spam', 'eggs'], ttl=10)
+        >>> n.expire(n.timestamp('eggs') + 10)
+        2
+        >>> n
+        NGramWindow([])
+        """
+        ttl = self.ttl
+        max_items = self.max_items
+        if ttl is None and max_items is None:
+            return 0
+        if now is None:
+            now = self.clock() if self.clock is not None else self._latest
+        order = self._order
+        times = self._times
+        expired = 0
+        while order:
+            timestamp, item = order[0]
+            if times.get(item, self) != timestamp:
+                order.popleft() # refreshed or removed since
+                continue
+            if not ((ttl is not None and timestamp <= now - ttl) or
+                    (max_items is not None and len(self) > max_items)):
+                break
+            order.popleft()
+            self.remove(item)
+            expired += 1
+        return expired
+
+    def _shared(self, ngrams, stats=None, deadline=None, max_postings=None):
+        # Every search goes through here, so no expired item is returned
+        if self.clock is not None:
+            self.expire()
+        return NGram._shared(self, ngrams, stats, deadline, max_postings)
@@ -9,19 +9,379 @@ consisting of the fields from the first file, a column with the similarity
 value, and then the fields from the second file.
 """
 
-import csv, os, re, sys
+import cPickle as pickle
+import csv, hashlib, heapq, json, os, re, sys, time
+from collections import deque
+from itertools import islice
 from ngram import NGram
 
+# Right-hand index inherited by forked worker processes
+_index = None
+
 def lowstrip(term):
     """Convert to lowercase and strip spaces"""
     term = re.sub('\s+', ' ', term)
     term = term.lower()
     return term
 
+class ColumnKey(object):
+    """Picklable key function normalizing one column of a row."""
+
+    # Change whenever `lowstrip` changes, to invalidate cached indexes
+    normalization = 'lowstrip-1'
+
+    def __init__(self, column):
+        self.column = column
+
+    def __call__(self, row):
+        return lowstrip(row[self.column])
+
+def file_digest(path, blocksize=1 << 20):
+    """Return the SHA-1 hex digest of the file contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def index_rows(rows, column, block_column, minscore, warp):
+    """Index rows by the normalized value of a column.
+
+    :param block_column: when not None, partition the rows by the exact value\
+    of this column and return a dictionary from that value to an index of the\
+    rows in the block.
+    """
+    key = ColumnKey(column)
+    if block_column is None:
+        return NGram(rows, threshold=minscore, warp=warp, key=key)
+    blocks = {}
+    for row in rows:
+        blocks.setdefault(row[block_column], []).append(row)
+    return dict((value, NGram(block, threshold=minscore, warp=warp, key=key))
+                for value, block in blocks.iteritems())
+
+class JoinStats(object):
+    """Throughput counters for a join, merged across worker processes."""
+
+    counter_names = ('queries', 'candidates', 'candidate_seconds',
+                     'score_seconds', 'output_rows', 'write_seconds')
+
+    def __init__(self, progress=None, stream=sys.stderr):
+        self.counters = dict.fromkeys(self.counter_names, 0)
+        self.build_seconds = 0.0
+        self.progress = progress
+        self.stream = stream
+        self.start = self.last_report = time.time()
+
+    def record(self, candidates, candidate_seconds, score_seconds):
+        """Count one query with its candidates and time spent per phase."""
+        self.counters['queries'] += 1
+        self.counters['candidates'] += candidates
+        self.counters['candidate_seconds'] += candidate_seconds
+        self.counters['score_seconds'] += score_seconds
+
+    def merge(self, counters):
+        for name, value in counters.iteritems():
+            self.counters[name] += value
+
+    def write(self, out, rows):
+        """Write output rows, counting them and the time taken."""
+        start = time.time()
+        out.writerows(rows)
+        self.counters['output_rows'] += len(rows)
+        self.counters['write_seconds'] += time.time() - start
+        self.maybe_report()
+
+    def maybe_report(self):
+        """Report progress if `progress` seconds passed since the last time."""
+        if self.progress and time.time() - self.last_report >= self.progress:
+            self.report()
+
+    def summary(self):
+        """Return the counters and derived rates as a dictionary."""
+        summary = dict(self.counters)
+        elapsed = time.time() - self.start
+        queries = summary['queries']
+        summary.update(
+            elapsed_seconds=elapsed,
+            build_seconds=self.build_seconds,
+            rows_per_second=queries / elapsed if elapsed else 0.0,
+            candidates_per_query=(summary['candidates'] / float(queries)
+                                  if queries else 0.0),
+            output_rows_per_second=(
+                summary['output_rows'] / summary['write_seconds']
+                if summary['write_seconds'] else 0.0))
+        return summary
+
+    def report(self):
+        """Print a progress line to the stream."""
+        summary = self.summary()
+        self.stream.write(
+            "csvjoin: %(queries)d rows in %(elapsed_seconds).1fs "
+            "(%(rows_per_second).1f rows/s), build %(build_seconds).1fs, "
+            "%(candidates_per_query).1f candidates/row, "
+            "candidates %(candidate_seconds).1fs, "
+            "scoring %(score_seconds).1fs, "
+            "%(output_rows_per_second).0f output rows/s\n" % summary)
+        self.stream.flush()
+        self.last_report = time.time()
+
+def search_index(index, row, column, block_column, minscore, stats=None):
+    """Search an index from `index_rows` for rows similar to a row.
+
+    :param stats: optional `JoinStats` recording the candidates and timings.
+    """
+    if block_column is not None:
+        index = index.get(row[block_column])
+        if index is None:
+            if stats is not None:
+                stats.record(0, 0.0, 0.0)
+            return []
+    query = lowstrip(row[column])
+    if stats is None:
+        return index.search(query, threshold=minscore)
+    start = time.time()
+    shared = index.items_sharing_ngrams(query)
+    middle = time.time()
+    results = index.rank_candidates(query, shared, minscore)
+    stats.record(len(shared), middle - start, time.time() - middle)
+    return results
+
+def dump_index(index, f):
+    """Write an index from `index_rows` to an open binary file."""
+    if isinstance(index, NGram):
+        pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+        index.dump(f)
+    else:
+        pickle.dump(index.keys(), f, pickle.HIGHEST_PROTOCOL)
+        for value in index.keys():
+            index[value].dump(f)
+
+def load_index(f):
+    """Read an index written by `dump_index` from an open binary file."""
+    values = pickle.load(f)
+    if values is None:
+        return NGram.load(f)
+    return dict((value, NGram.load(f)) for value in values)
+
+def build_index(right_path, right_column, titles, minscore, warp,
+                block_column=None):
+    """Index the rows of the right-hand file.
+
+    :return: pair of header row (None without titles) and index.
+    """
+    right_file = csv.reader(open(right_path, 'r'))
+    right_header = right_file.next() if titles else None
+    index = index_rows((tuple(r) for r in right_file if r), right_column,
+                       block_column, minscore, warp)
+    return right_header, index
+
+def cached_index(cache_path, right_path, right_column, titles, minscore, warp,
+                 block_column=None):
+    """Like `build_index`, but reuse the index saved at `cache_path` when it
+    was built from identical file contents and settings, otherwise build the
+    index and save it there."""
+    fingerprint = dict(digest=file_digest(right_path), column=right_column,
+                       titles=titles, warp=warp, N=3, block=block_column,
+                       normalization=ColumnKey.normalization)
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as f:
+            try:
+                stored = pickle.load(f)
+                if stored == fingerprint:
+                    right_header = pickle.load(f)
+                    index = load_index(f)
+                    for sub in (index.values() if isinstance(index, dict)
+                                else [index]):
+                        sub.threshold = minscore
+                    return right_header, index
+            except Exception:
+                # An unreadable cache, or one pickled with classes this
+                # process cannot import, is rebuilt like a stale one
+                pass
+    right_header, index = build_index(right_path, right_column, titles,
+                                      minscore, warp, block_column)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(fingerprint, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(right_header, f, pickle.HIGHEST_PROTOCOL)
+        dump_index(index, f)
+    os.rename(temp_path, cache_path)
+    return right_header, index
+
+def chunked(iterable, size):
+    """Iterate over lists of up to `size` consecutive items.
+
+    >>> list(chunked(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def match_rows(index, rows, left_column, join, minscore, count,
+               block_column=None, stats=None):
+    """Return the output rows for a sequence of left-hand rows."""
+    output = []
+    for row in rows:
+        if not row: continue # skip blank lines
+        row = tuple(row)
+        results = search_index(index, row, left_column, block_column,
+                               minscore, stats)
+        if results:
+            if count > 0:
+                results = results[:count]
+            for rank, result in enumerate(results, 1):
+                output.append(row + (rank, result[1]) + result[0])
+        elif join == "outer":
+            output.append(row)
+    return output
+
+def probe_rows(index, rows, start, right_column, block_column, minscore,
+               stats=None):
+    """Search an index of numbered left-hand rows for each right-hand row.
+
+    :param start: position of the first of `rows` in the right-hand file.
+    :return: list of ``(left item, similarity, position, right row)``.
+    """
+    output = []
+    for position, row in enumerate(rows, start):
+        if not row: continue # skip blank lines
+        row = tuple(row)
+        for item, similarity in search_index(index, row, right_column,
+                                             block_column, minscore, stats):
+            output.append((item, similarity, position, row))
+    return output
+
+def measured(index, func, *args):
+    """Call ``func(index, *args, stats=...)`` returning its result and the
+    counters of a fresh `JoinStats`, for collection from worker processes."""
+    stats = JoinStats()
+    return func(index, *args, stats=stats), stats.counters
+
+def _run_task(args):
+    """Worker process entry point, applying a function to the inherited index."""
+    return args[0](_index, *args[1:])
+
+def ordered_imap(pool, func, iterable, window):
+    """Like `pool.imap`, but only keeps `window` tasks in flight so that
+    input is consumed no faster than results are, bounding memory."""
+    pending = deque()
+    for args in iterable:
+        pending.append(pool.apply_async(func, (args,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def run_chunks(func, index, tasks, jobs):
+    """Iterate over ``func(index, *task)`` for each task, in order.
+
+    With `jobs` greater than one the tasks run in a pool of worker processes
+    that share `index` through fork, with two tasks per worker in flight.
+    """
+    global _index
+    if jobs <= 1:
+        for task in tasks:
+            yield func(index, *task)
+        return
+    from multiprocessing import Pool
+    _index = index
+    pool = Pool(jobs)
+    try:
+        for result in ordered_imap(pool, _run_task,
+                                   ((func,) + task for task in tasks), 2 * jobs):
+            yield result
+    finally:
+        pool.terminate()
+        _index = None
+
+def run_measured(func, index, tasks, jobs, stats):
+    """Like `run_chunks`, merging counters into `stats` if it is not None."""
+    if stats is None:
+        return run_chunks(func, index, tasks, jobs)
+    def results():
+        for result, counters in run_chunks(
+                measured, index, ((func,) + task for task in tasks), jobs):
+            stats.merge(counters)
+            yield result
+    return results()
+
+def reverse_join(out, left_path, left_column, right_path, right_column,
+                 titles, join, minscore, count, warp, jobs, chunksize,
+                 block_left, block_right, stats=None):
+    """Perform the similarity join by indexing the left-hand file and probing
+    it with the right-hand rows, with output identical in form to `main`."""
+    left_file = csv.reader(open(left_path, 'r'))
+    left_header = left_file.next() if titles else None
+    left_rows = [tuple(r) for r in left_file]
+    # Number the left rows so that duplicate rows stay distinct items
+    shift = lambda column: None if column is None else column + 1
+    start = time.time()
+    index = index_rows(((n,) + row for n, row in enumerate(left_rows) if row),
+                       left_column + 1, shift(block_left), minscore, warp)
+    if stats is not None:
+        stats.build_seconds = time.time() - start
+    right_file = csv.reader(open(right_path, 'r'))
+    right_header = right_file.next() if titles else None
+    if titles:
+        out.writerow(left_header + ["Rank", "Similarity"] + right_header)
+    def tasks():
+        start = 0
+        for rows in chunked(right_file, chunksize):
+            yield (rows, start, right_column, block_right, minscore)
+            start += len(rows)
+    # Heap of the best (similarity, -position, right row) per left row number
+    best = {}
+    for probes in run_measured(probe_rows, index, tasks(), jobs, stats):
+        for item, similarity, position, row in probes:
+            heap = best.setdefault(item[0], [])
+            if count > 0 and len(heap) >= count:
+                heapq.heappushpop(heap, (similarity, -position, row))
+            else:
+                heapq.heappush(heap, (similarity, -position, row))
+        if stats is not None:
+            stats.maybe_report() # nothing is written until all are probed
+    for n, row in enumerate(left_rows):
+        if not row: continue # skip blank lines
+        results = sorted(best.pop(n, []), reverse=True)
+        output = [row + (rank, similarity) + match
+                  for rank, (similarity, _, match) in enumerate(results, 1)]
+        if not output and join == "outer":
+            output = [row]
+        if stats is not None:
+            stats.write(out, output)
+        else:
+            out.writerows(output)
+
 def main(left_path, left_column, right_path, right_column,
-         outfile, titles, join, minscore, count, warp):
+         outfile, titles, join, minscore, count, warp, jobs=1, chunksize=1000,
+         index_cache=None, block_left=None, block_right=None,
+         index_smaller=False, progress=None, stats_path=None):
     """Perform the similarity join
 
+    With `jobs` greater than one, left-hand rows are streamed in chunks of
+    `chunksize` rows to a pool of worker processes that share the right-hand
+    index through fork.  Output stays in input order and at most two chunks
+    per worker are held in memory at once.
+
+    With `index_cache`, the right-hand index is saved to that file and reused
+    by later runs against the same right file contents and settings.
+
+    With `block_left` and `block_right` columns, a left row is only compared
+    with the right rows having exactly the same value in the blocking column.
+
+    With `index_smaller`, the smaller file is indexed, which saves memory and
+    time when the left file is much smaller than the right one.  The output is
+    the same, except for the order of equally similar matches.
+
+    With `progress`, throughput is reported to stderr every `progress`
+    seconds, and with `stats_path` a JSON summary of the run is written there
+    (``-`` for stderr).
+
     >>> open('left.csv', 'w').write('''ID,NAME
     ... 1,Joe
     ... 2,Kin
@@ -44,29 +404,100 @@ def main(left_path, left_column, right_path, right_column,
     2,Kin,1,0.25,D,Kim
     3,ZAS
     <BLANKLINE>
+    >>> main(left_path='left.csv', left_column=1,
+    ... right_path='right.csv', right_column=1, outfile='out2.csv',
+    ... titles=True, join='outer', minscore=0.24, count=5, warp=1.0,
+    ... jobs=2, chunksize=1)
+    >>> open('out2.csv').read() == open('out.csv').read()
+    True
+    >>> os.remove('out2.csv')
+    >>> for run in range(2):
+    ...     main(left_path='left.csv', left_column=1,
+    ...     right_path='right.csv', right_column=1, outfile='out3.csv',
+    ...     titles=True, join='outer', minscore=0.24, count=5, warp=1.0,
+    ...     index_cache='right.idx')
+    ...     print open('out3.csv').read() == open('out.csv').read()
+    True
+    True
+    >>> open('bad.idx', 'wb').write('c__main__\\nMissingKey\\n.')
+    >>> main(left_path='left.csv', left_column=1,
+    ... right_path='right.csv', right_column=1, outfile='out3.csv',
+    ... titles=True, join='outer', minscore=0.24, count=5, warp=1.0,
+    ... index_cache='bad.idx')
+    >>> open('out3.csv').read() == open('out.csv').read()
+    True
+    >>> os.remove('bad.idx')
+    >>> os.remove('out3.csv'); os.remove('right.idx')
+    >>> main(left_path='left.csv', left_column=1,
+    ... right_path='right.csv', right_column=1, outfile='out4.csv',
+    ... titles=True, join='outer', minscore=0.24, count=5, warp=1.0,
+    ... index_smaller=True)
+    >>> open('out4.csv').read() == open('out.csv').read()
+    True
+    >>> open('left_b.csv', 'w').write('''1,Joe,UK
+    ... 2,Joe,US''')
+    >>> open('right_b.csv', 'w').write('''A,Joe,UK
+    ... B,Jon,US''')
+    >>> main(left_path='left_b.csv', left_column=1,
+    ... right_path='right_b.csv', right_column=1, outfile='out5.csv',
+    ... titles=False, join='outer', minscore=0.24, count=5, warp=1.0,
+    ... block_left=2, block_right=2)
+    >>> print open('out5.csv').read()  #doctest: +NORMALIZE_WHITESPACE
+    1,Joe,UK,1,1.0,A,Joe,UK
+    2,Joe,US,1,0.25,B,Jon,US
+    <BLANKLINE>
+    >>> for path in ['out4.csv', 'out5.csv', 'left_b.csv', 'right_b.csv']:
+    ...     os.remove(path)
+    >>> main(left_path='left.csv', left_column=1,
+    ... right_path='right.csv', right_column=1, outfile='out6.csv',
+    ... titles=True, join='outer', minscore=0.24, count=5, warp=1.0,
+    ... jobs=2, stats_path='stats.json')
+    >>> open('out6.csv').read() == open('out.csv').read()
+    True
+    >>> import json
+    >>> summary = json.load(open('stats.json'))
+    >>> summary['queries'], summary['candidates'], summary['output_rows']
+    (3, 6, 5)
+    >>> os.remove('out6.csv'); os.remove('stats.json')
     """
-    right_file = csv.reader(open(right_path, 'r'))
-    if titles:
-        right_header = right_file.next()
-    index = NGram((tuple(r) for r in right_file),
-                  threshold=minscore,
-                  warp=warp, key=lambda x: lowstrip(x[right_column]))
-    left_file = csv.reader(open(left_path, 'r'))
     out = csv.writer(open(outfile, 'w'))
-    if titles:
-        left_header = left_file.next()
-        out.writerow(left_header + ["Rank", "Similarity"] + right_header)
-    for row in left_file:
-        if not row: continue # skip blank lines
-        row = tuple(row)
-        results = index.search(lowstrip(row[left_column]), threshold=minscore)
-        if results:
-            if count > 0:
-                results = results[:count]
-            for rank, result in enumerate(results, 1):
-                out.writerow(row + (rank, result[1]) + result[0])
-        elif join == "outer":
-            out.writerow(row)
+    stats = JoinStats(progress) if (progress or stats_path) else None
+    if index_smaller and (os.path.getsize(left_path) <
+                          os.path.getsize(right_path)):
+        reverse_join(out, left_path, left_column, right_path, right_column,
+                     titles, join, minscore, count, warp, jobs, chunksize,
+                     block_left, block_right, stats)
+    else:
+        start = time.time()
+        if index_cache:
+            right_header, index = cached_index(index_cache, right_path,
+                            right_column, titles, minscore, warp, block_right)
+        else:
+            right_header, index = build_index(right_path, right_column, titles,
+                                              minscore, warp, block_right)
+        if stats is not None:
+            stats.build_seconds = time.time() - start
+        left_file = csv.reader(open(left_path, 'r'))
+        if titles:
+            left_header = left_file.next()
+            out.writerow(left_header + ["Rank", "Similarity"] + right_header)
+        tasks = ((rows, left_column, join, minscore, count, block_left)
+                 for rows in chunked(left_file, chunksize))
+        for output in run_measured(match_rows, index, tasks, jobs, stats):
+            if stats is not None:
+                stats.write(out, output)
+            else:
+                out.writerows(output)
+    if stats is not None:
+        if progress:
+            stats.report()
+        if stats_path:
+            summary = json.dumps(stats.summary(), indent=2, sort_keys=True)
+            if stats_path == '-':
+                sys.stderr.write(summary + '\n')
+            else:
+                with open(stats_path, 'w') as f:
+                    f.write(summary + '\n')
 
 def console_main():
     """Process command-line arguments."""
@@ -85,13 +516,33 @@ def console_main():
                 help='Max number of rows to match (0 for all): %(default)s')
     parser.add_argument('-w', '--warp', type=float,
             help='N-gram warp, higher helps short strings: %(default)s')
+    parser.add_argument('--jobs', type=int,
+            help='Number of worker processes matching rows: %(default)s')
+    parser.add_argument('--chunksize', type=int,
+            help='Rows of the first file sent to a worker at once: %(default)s')
+    parser.add_argument('--index-cache', metavar='PATH',
+            help=('Save the index of the second file to PATH and reuse it '
+                  'while the file and settings are unchanged'))
+    parser.add_argument('--block-left', type=int, metavar='COL',
+            help='Only match rows with equal values in this column of the '
+                 'first file and the --block-right column of the second file')
+    parser.add_argument('--block-right', type=int, metavar='COL',
+            help='Blocking column in the second CSV file')
+    parser.add_argument('--index-smaller', action='store_true',
+            help=('Index whichever file is smaller instead of always the '
+                  'second file (the index cache is only used for the second)'))
+    parser.add_argument('--progress', type=float, metavar='SECONDS',
+            help='Report throughput to stderr every SECONDS')
+    parser.add_argument('--stats', metavar='PATH',
+            help='Write a JSON summary of the run to PATH (- for stderr)')
     parser.add_argument('left', nargs=1, help='First CSV file')
     parser.add_argument('leftcolumn', nargs=1, type=int, help='Column in first CSV file')
     parser.add_argument('right', nargs=1, help='Second CSV file')
     parser.add_argument('rightcolumn', nargs=1, type=int, help='Column in second CSV file')
     parser.add_argument('outfile', nargs=1, help='Output CSV file')
     parser.set_defaults(
-        titles=False, join='outer', minscore=0.24, count=0, warp=1.0)
+        titles=False, join='outer', minscore=0.24, count=0, warp=1.0,
+        jobs=1, chunksize=1000, index_smaller=False)
     args = parser.parse_args()
     for path in [args.left[0], args.right[0]]:
         if not os.path.isfile(path):
@@ -100,11 +551,19 @@ def console_main():
         parser.error("Minimum score must be between 0 and 1")
     if not args.count >= 0:
         parser.error("Maximum number of matches per row must be non-negative.")
+    if not args.jobs >= 1:
+        parser.error("Number of jobs must be at least 1.")
+    if not args.chunksize >= 1:
+        parser.error("Chunk size must be at least 1.")
+    if (args.block_left is None) != (args.block_right is None):
+        parser.error("--block-left and --block-right must be used together.")
     if args.count == 0:
         args.count = None # to return all results
     main(args.left[0], args.leftcolumn[0], args.right[0], args.rightcolumn[0],
          args.outfile[0], args.titles, args.join, args.minscore, args.count,
-         args.warp)
+         args.warp, args.jobs, args.chunksize, args.index_cache,
+         args.block_left, args.block_right, args.index_smaller,
+         args.progress, args.stats)
 
 
 if __name__ == '__main__':
@@ -51,7 +51,10 @@ if sys.version_info >= (3,):
 setup(
     name = 'ngram',
     version = '3.2',
-    py_modules = ['ngram'],
+    py_modules = ['ngram', 'ngram_abstract', 'ngram_background',
+                  'ngram_frozen', 'ngram_log', 'ngram_lsh', 'ngram_partition',
+                  'ngram_redis', 'ngram_server', 'ngram_shard',
+                  'ngram_sqlite', 'ngram_vector', 'ngram_window'],
     zip_safe = True,
     author = 'Graham Poulter, Michael Albert',
     maintainer = 'Graham Poulter',
@@ -21,10 +21,95 @@ Lesser General Public License for more details.
 """
 
 from pprint import pprint as pp
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 import string
 
 from ngram import NGram
+from ngram_background import BackgroundNGram
+from ngram_log import LoggedNGram
+from ngram_lsh import NGramLSH
+from ngram_partition import PartitionedNGram
+from ngram_server import NGramClient, NGramServer
+from ngram_shard import ShardedNGram
+from ngram_sqlite import NGramSQLite
+from ngram_window import NGramWindow
+from ngram_redis import NGramRedis
+
+class FakeRedis(object):
+    """The Redis commands used by NGramRedis, on dictionaries, with
+    pipelines that run each command on `execute`."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def zcard(self, name):
+        return len(self.data.get(name, {}))
+
+    def zincrby(self, name, value, amount=1):
+        zset = self.data.setdefault(name, {})
+        zset[str(value)] = zset.get(str(value), 0) + amount
+        return zset[str(value)]
+
+    def zrange(self, name, start, end, withscores=False):
+        return sorted(self.data.get(name, {}).items())
+
+    def hset(self, name, key, value):
+        self.data.setdefault(name, {})[str(key)] = str(value)
+
+    def hincrby(self, name, key, amount=1):
+        value = int(self.data.get(name, {}).get(str(key), 0)) + amount
+        self.hset(name, key, value)
+        return value
+
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(str(key))
+
+    def hmget(self, name, keys):
+        return [self.hget(name, key) for key in keys]
+
+    def delete(self, name):
+        return int(self.data.pop(name, None) is not None)
+
+    def hvals(self, name):
+        return self.data.get(name, {}).values()
+
+    def scan_iter(self, match=None, count=None):
+        return iter(list(self.data))
+
+    def execute_command(self, *args):
+        if args[:2] == ('MEMORY', 'USAGE'):
+            return self.memory_usage(args[2])
+        raise NotImplementedError(args)
+
+    def memory_usage(self, name):
+        """Made up size of a key: a fixed cost plus one per entry."""
+        return 50 + 10 * len(self.data[name])
+
+    def info(self, section=None):
+        return dict(used_memory=sum(self.memory_usage(name)
+                                    for name in self.data))
+
+class FakePipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.commands.append(
+            (method, args, kwargs))
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
 
 class NgramTests(unittest.TestCase):
     """Tests of the ngram class"""
@@ -71,6 +156,360 @@ class NgramTests(unittest.TestCase):
         self.assertEqual(results(idx1.search('ijk')), [])
         self.assertEqual(results(idx1.search('def')), ['cdefg'])
 
+    def test_remove_repeated_ngram(self):
+        """Removing an item whose key repeats an n-gram"""
+        idx = NGram(['abcabc', 'abd'])
+        idx.remove('abcabc')
+        self.assertEqual(idx.search('abcabc'), [('abd', 0.18181818181818182)])
+        idx.add('abcabc')
+        self.assertEqual(idx.search('abcabc')[0], ('abcabc', 1.0))
+
+    def test_sqlite_matches_memory(self):
+        """SQLite backend gives the same results as the in-memory index"""
+        idx = NGramSQLite(self.items, batch_size=2)
+        mem = NGram(self.items)
+        for query in ['askfjwehiuasdfji', 'afadfwe', 'zzz', 'asasas']:
+            self.assertEqual(sorted(idx.search(query)), sorted(mem.search(query)))
+        idx.remove('adfwe')
+        mem.remove('adfwe')
+        self.assertEqual(sorted(idx.search('afadfwe')),
+                         sorted(mem.search('afadfwe')))
+        self.assertEqual(len(idx), len(mem))
+
+    def test_lsh_scores_exactly(self):
+        """Approximate search finds near-duplicates with exact similarity"""
+        idx = NGramLSH(self.items, bands=32, rows=2)
+        exact = dict(NGram(self.items).search('asdfawe'))
+        results = idx.search('asdfawe')
+        self.assertEqual(results[0], ('asdfawe', 1.0))
+        for item, similarity in results:
+            self.assertEqual(similarity, exact[item])
+        idx.remove('asdfawe')
+        self.assertTrue('asdfawe' not in dict(idx.search('asdfawe')))
+        self.assertRaises(TypeError, idx.freeze)
+        self.assertRaises(TypeError, idx.dump, None)
+        self.assertEqual(idx.stats()['items'], len(self.items) - 1)
+
+    def test_gram_ids(self):
+        """Integer n-gram ids give the same results as n-gram strings"""
+        idx = NGram(self.items)
+        for gram_ids in ['packed', 'hashed']:
+            other = NGram(self.items, gram_ids=gram_ids)
+            self.assertTrue(all(isinstance(g, (int, long)) for g in other._grams))
+            for query in ['askfjwehiuasdfji', 'afadfwe', 'zzz']:
+                self.assertEqual(sorted(other.search(query)),
+                                 sorted(idx.search(query)))
+        self.assertRaises(ValueError, NGram, gram_ids='packed', N=9)
+
+    def test_packed_query_out_of_alphabet(self):
+        """A query character that does not fit packed ids matches nothing,
+        while an item with one cannot be added"""
+        items = [u'cafe', u'spam']
+        query = u'caf\U0001F600'
+        expected = NGram(items, N=4).search(query)
+        idx = NGram(items, gram_ids='packed', N=4)
+        for index in [idx, idx.freeze()]:
+            self.assertEqual(index.search(query), expected)
+            self.assertEqual(index.search_batch([query]), [expected])
+            self.assertFalse(query in index)
+        self.assertEqual(idx.search(query, timeout=10), expected)
+        self.assertRaises(ValueError, idx.add, query)
+
+    def test_freeze(self):
+        """A frozen index searches like the NGram it was frozen from"""
+        idx = NGram(self.items, gram_ids='packed')
+        for frozen in [idx.freeze(), idx.freeze(compress=True)]:
+            self.assertEqual(sorted(frozen), sorted(idx))
+            self.assertTrue('asdfawe' in frozen and 'asdf' not in frozen)
+            for query in ['askfjwehiuasdfji', 'afadfwe', 'zzz']:
+                self.assertEqual(frozen.search(query), idx.search(query))
+                self.assertEqual(frozen.find(query), idx.find(query))
+            self.assertRaises(TypeError, frozen.update, ['spam'])
+
+    def test_set_algebra(self):
+        """Set operations on indexes match indexes built from scratch"""
+        def check(index, items):
+            fresh = NGram(items)
+            self.assertEqual(sorted(index), sorted(fresh))
+            self.assertEqual(index.length, fresh.length)
+            self.assertEqual(dict((g, p) for g, p in index._grams.items() if p),
+                             dict((g, p) for g, p in fresh._grams.items() if p))
+        left = self.items[:3]
+        right = self.items[2:]
+        a, b = NGram(left), NGram(right)
+        check(a | b, set(left) | set(right))
+        check(a & b, set(left) & set(right))
+        check(a - b, set(left) - set(right))
+        check(a ^ b, set(left) ^ set(right))
+        a.symmetric_difference_update(right)
+        check(a, set(left) ^ set(right))
+        a -= set(self.items[:1])
+        check(a, (set(left) ^ set(right)) - set(self.items[:1]))
+
+    def test_window(self):
+        """A window index searches like an NGram of its unexpired items"""
+        idx = NGramWindow(ttl=3, max_items=2, clock=None)
+        for i, item in enumerate(self.items):
+            idx.add(item)
+            live = self.items[max(0, i - 1):i + 1]
+            self.assertEqual(sorted(idx), sorted(live))
+            self.assertEqual(idx.search('asdfawe'), NGram(live).search('asdfawe'))
+        self.assertTrue(all(idx._grams.values()))
+        self.assertEqual(idx.expire(idx.timestamp(self.items[-1]) + 3), 2)
+        self.assertEqual(idx._grams, {})
+        self.assertRaises(TypeError, idx.dump, None)
+
+    def test_background(self):
+        """A background build searches the items indexed so far, and ends
+        with the same results as NGram"""
+        paused, resume = threading.Event(), threading.Event()
+        def items():
+            for i, item in enumerate(self.items):
+                if i == 2: # after the first batch is indexed
+                    paused.set()
+                    resume.wait()
+                yield item
+        idx = BackgroundNGram(items(), partial=True, batch_size=2)
+        paused.wait()
+        results = idx.search('asdfawe')
+        self.assertFalse(results.complete)
+        self.assertEqual(results, NGram(self.items[:2]).search('asdfawe'))
+        resume.set()
+        self.assertTrue(idx.wait())
+        self.assertEqual((idx.indexed, idx.total), (len(self.items), None))
+        results = idx.search('asdfawe')
+        self.assertTrue(results.complete)
+        self.assertEqual(results, NGram(self.items).search('asdfawe'))
+        old = idx.index
+        idx.rebuild(self.items[:2])
+        self.assertTrue(idx.wait())
+        self.assertTrue(idx.index is not old)
+        self.assertEqual(sorted(idx.index), sorted(self.items[:2]))
+
+    def test_max_df(self):
+        """Stop-grams are skipped, and scores of the candidates stay exact"""
+        idx = NGram(self.items)
+        capped = NGram(self.items, max_df=2)
+        self.assertTrue(capped.stop_grams())
+        for query in ['askfjwehiuasdfji', 'afadfwe', 'asfwe']:
+            exact = dict(idx.search(query))
+            results = capped.search(query)
+            self.assertTrue(results)
+            for item, similarity in results:
+                self.assertEqual(similarity, exact[item])
+        self.assertRaises(ValueError, NGram, max_df=1.5)
+        for frozen in [capped.freeze(), capped.freeze(compress=True)]:
+            for query in ['askfjwehiuasdfji', 'afadfwe', 'asfwe', 'sxx']:
+                self.assertEqual(sorted(frozen.search(query)),
+                                 sorted(capped.search(query)))
+        window = NGramWindow(self.items, clock=None, max_df=2)
+        self.assertEqual(sorted(window.stop_grams()),
+                         sorted(capped.stop_grams()))
+
+    def test_search_budget(self):
+        """Budgeted searches are flagged incomplete, with exact similarities"""
+        idx = NGram(self.items)
+        exact = dict(idx.search('asdfawe'))
+        results = idx.search('asdfawe', max_postings=3)
+        self.assertFalse(results.complete)
+        self.assertEqual(results[0], ('asdfawe', 1.0))
+        for item, similarity in results:
+            self.assertEqual(similarity, exact[item])
+        self.assertTrue(idx.search('asdfawe', timeout=60).complete)
+        self.assertEqual(idx.find('asdfawe', max_postings=3), 'asdfawe')
+
+    def test_stats(self):
+        """Index statistics agree with the posting lists"""
+        idx = NGram(self.items)
+        idx.remove('adfwe')
+        info = idx.stats(top=3)
+        self.assertEqual(info['items'], len(self.items) - 1)
+        self.assertEqual(info['postings'],
+                         sum(len(p) for p in idx._grams.values()))
+        self.assertEqual(info['grams'] + info['empty_grams'], len(idx._grams))
+        self.assertEqual(len(info['top_grams']), 3)
+        self.assertEqual(info['top_grams'][0][1], info['posting_lengths']['max'])
+        self.assertEqual(info['memory']['total'],
+                         sum(v for k, v in info['memory'].items() if k != 'total'))
+
+    def test_log(self):
+        """A logged index reopens to the same items after a torn write"""
+        path = tempfile.mkdtemp()
+        try:
+            idx = LoggedNGram(path, sync_every=2)
+            idx.update(self.items)
+            idx.remove('adfwe')
+            idx.add('adfwe!')
+            idx.close()
+            with open(os.path.join(path, 'log'), 'ab') as f:
+                f.write('\x40\x00\x00\x00torn') # crash mid-record
+            idx = LoggedNGram(path, checkpoint_every=2)
+            expected = NGram(self.items[:3] + ['askfjwehiuasdfji', 'adfwe!'])
+            self.assertEqual(sorted(idx), sorted(expected))
+            self.assertEqual(idx.search('adfwe'), expected.search('adfwe'))
+            idx.discard('asfwef')
+            self.assertEqual(idx.logged, 0) # checkpointed
+            idx.remove('asfwef') # absent, so ignored and not logged, as NGram
+            self.assertEqual(idx.logged, 0)
+            idx.close()
+            self.assertEqual(sorted(LoggedNGram(path)),
+                             sorted(expected - set(['asfwef'])))
+        finally:
+            shutil.rmtree(path)
+
+    def test_partition(self):
+        """Partition-filtered searches match an NGram of the partition"""
+        label = lambda item: item[0]
+        idx = PartitionedNGram(self.items, partition=label)
+        self.assertEqual(sorted(idx.labels()), ['a', 's'])
+        for query in ['asdfawe', 'sdfwe']:
+            self.assertEqual(idx.search(query), NGram(self.items).search(query))
+            for part in ['a', 's']:
+                expected = NGram([i for i in self.items if label(i) == part])
+                self.assertEqual(idx.search(query, partition=part),
+                                 expected.search(query))
+        self.assertEqual(idx.search('asdfawe', partition='z'), [])
+        idx.remove('sdafaf')
+        self.assertEqual(sorted(idx.labels()), ['a'])
+        self.assertRaises(KeyError, idx.remove, 'sdafaf')
+
+    def test_searchitem_threshold(self):
+        """The threshold of searchitem filters the results of every index"""
+        expected = [item for item in NGram(self.items).search('asdfawe')
+                    if item[1] >= 0.2]
+        self.assertEqual(len(expected), 2)
+        path = tempfile.mkdtemp()
+        try:
+            logged = LoggedNGram(path)
+            logged.update(self.items)
+            background = BackgroundNGram(self.items)
+            partitioned = PartitionedNGram(self.items, partition=len)
+            for idx in [NGram(self.items), logged, background, partitioned]:
+                self.assertEqual(sorted(idx.searchitem('asdfawe', 0.2)),
+                                 sorted(expected))
+                self.assertEqual(idx.finditem('zzzzzz', 0.2), None)
+            logged.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_server(self):
+        """Served searches by pooled workers match searches of the index"""
+        idx = NGram(self.items)
+        tmpdir = tempfile.mkdtemp()
+        server = NGramServer(idx, os.path.join(tmpdir, 'ngram.sock'), workers=2)
+        try:
+            server.start()
+            client = NGramClient(server.address)
+            queries = ['asdfawe', 'adfwe', 'zzz', 'askfjwe']
+            self.assertEqual(client.search_batch(queries, 0.2),
+                             [idx.search(query, 0.2) for query in queries])
+            self.assertEqual(client.find('asfwe'), idx.find('asfwe'))
+            results = client.search('asdfawe', max_postings=3)
+            self.assertFalse(results.complete)
+            self.assertRaises(ValueError, client.search, None)
+            client.close()
+        finally:
+            server.shutdown()
+            shutil.rmtree(tmpdir)
+
+    def test_server_errors(self):
+        """A request whose results cannot be sent gets an error response"""
+        unsendable = lambda: None # neither JSON nor picklable
+        idx = NGram([unsendable, 'spam'], key=lambda item: 'spam')
+        for workers in [1, 2]:
+            server = NGramServer(idx, ('localhost', 0), workers=workers)
+            try:
+                server.start()
+                client = NGramClient(server.address, timeout=10)
+                self.assertRaises(ValueError, client.search, 'spam')
+                self.assertEqual(client.search('zzz'), [])
+                client.close()
+            finally:
+                server.shutdown()
+
+    def test_shards(self):
+        """Sharded searches match NGram, and survive a failed shard"""
+        idx = NGram(self.items)
+        sharded = ShardedNGram.spawn(self.items, 3, timeout=10)
+        try:
+            for query in ['asdfawe', 'adfwe', 'zzz']:
+                self.assertEqual(sharded.search(query), idx.search(query))
+            self.assertEqual(sharded.search('asdfawe', limit=2),
+                             idx.search('asdfawe')[:2])
+            self.assertEqual(sharded.find('asfwe'), idx.find('asfwe'))
+            sharded._processes[0].terminate()
+            sharded._processes[0].join()
+            results = sharded.search('asdfawe')
+            self.assertFalse(results.complete)
+            self.assertTrue(set(results) < set(idx.search('asdfawe')))
+            stats = sharded.stats()
+            self.assertEqual([s['failures'] for s in stats], [1, 0, 0])
+            self.assertEqual(stats[1]['requests'], 6)
+            self.assertTrue(stats[1]['latency']['max'] > 0)
+            for process in sharded._processes:
+                process.terminate()
+            self.assertRaises(EnvironmentError, sharded.search, 'asdfawe')
+        finally:
+            sharded.close()
+        self.assertRaises(RuntimeError, ShardedNGram.spawn, self.items, 2, N=0)
+
+    def test_shards_keep_items(self):
+        """Sharded searches return the items given, not their JSON"""
+        items = [(i, item) for i, item in enumerate(self.items)]
+        key = lambda item: item[1]
+        idx = NGram(items, key=key)
+        with ShardedNGram.spawn(items, 2, timeout=10, key=key) as sharded:
+            for query in ['asdfawe', 'adfwe']:
+                self.assertEqual(sharded.search(query), idx.search(query))
+            self.assertEqual(sharded.find('asfwe'), idx.find('asfwe'))
+
+    def test_redis_cache(self):
+        """Redis searches match NGram, from the posting list cache until an
+        add changes the posting lists"""
+        idx = NGramRedis(cache_size=100, client=FakeRedis())
+        for i, item in enumerate(self.items):
+            idx.add(item, i)
+        expected = lambda query: [(str(self.items.index(item)), similarity)
+                                  for item, similarity
+                                  in NGram(self.items).search(query)]
+        self.assertEqual(idx.search('asdfawe'), expected('asdfawe'))
+        misses = idx.cache_info()['misses']
+        self.assertEqual(idx.cache_info()['hits'], 0)
+        self.assertEqual(idx.search('asdfawe'), expected('asdfawe'))
+        self.assertEqual(idx.cache_info()['hits'], misses)
+        self.assertEqual(idx.cache_info()['misses'], misses)
+        self.items = self.items + ['asdfaw']
+        idx.add('asdfaw', len(self.items) - 1)
+        self.assertEqual(idx.search('asdfawe'), expected('asdfawe'))
+        self.assertTrue(idx.cache_info()['misses'] > misses)
+        idx.cache_size = 2
+        self.assertEqual(idx.search('adfwe'), expected('adfwe'))
+        self.assertEqual(idx.cache_info()['entries'], 2)
+        self.assertTrue(idx.cache_info()['evictions'] > 0)
+        queries = ['asdfawe', 'adfwe', 'sdaf', 'zzz']
+        self.assertEqual(idx.search_batch(queries),
+                         [idx.search(query) for query in queries])
+
+    def test_redis_stats(self):
+        """Redis stats describe the posting lists like NGram stats"""
+        client = FakeRedis()
+        idx = NGramRedis(client=client)
+        for i, item in enumerate(self.items):
+            idx.add(item, i)
+        stats = idx.stats(top=3)
+        expected = NGram(self.items).stats(top=3)
+        for name in ['items', 'grams', 'postings', 'posting_lengths',
+                     'top_grams', 'stop_grams', 'mean_padded_length']:
+            self.assertEqual(stats[name], expected[name])
+        memory = stats['memory']
+        self.assertEqual(memory['postings'],
+                         50 * expected['grams'] + 10 * expected['postings'])
+        self.assertEqual(memory['length'], 50 + 10 * len(self.items))
+        self.assertEqual(memory['versions'], 50 + 10 * expected['grams'])
+        self.assertEqual(memory['total'], memory['postings'] +
+                         memory['length'] + memory['versions'])
+        self.assertEqual(memory['used_memory'], memory['total'])
+
 
 if __name__ == "__main__":
     unittest.main()